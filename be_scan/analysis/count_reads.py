@@ -16,6 +16,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import warnings
 
+from be_scan.sgrna._genomic_ import encode_2bit, lookup_2bit
+
 def count_reads(
     sample_sheet, 
     annotated_lib, 
@@ -24,7 +26,7 @@ def count_reads(
     sgRNA_seq_col = 'sgRNA_seq', 
     lower_cutoff=0, lower_cutoff_cols=[], 
     in_dir='', out_dir='', out_file='library_counts.csv', 
-    return_df=True, save_files=True, plot_out_type='pdf', 
+    return_df=True, save_files=True, plot_out_type='pdf', batch_size=1000000, 
     ): 
     
     """[Summary]
@@ -79,6 +81,8 @@ def count_reads(
         Whether or not to save individual counts, noncounts, and stats files
     plot_out_type : str, optional, defaults to 'pdf'
         file type of figure output
+    batch_size : int, default 1000000
+        Number of guides read before they are matched to the library at once
 
     Returns
     ------------
@@ -106,9 +110,33 @@ def count_reads(
         raise Exception(f'{annotated_lib} is missing column: {sgRNA_seq_col}')
     df_ref[sgRNA_seq_col] = df_ref[sgRNA_seq_col].str.upper()
 
+    # ENCODE LIBRARY ONCE, READS ARE LOOKED UP BY BINARY SEARCH OF THE SORTED 2-BIT CODES #
+    lib_seqs = pd.unique(df_ref[sgRNA_seq_col])
+    lib_codes, lib_valid = encode_2bit(lib_seqs, length=20)
+    lib_valid_ind = np.append(np.flatnonzero(lib_valid), -1) # lookup misses (-1) map to the trailing -1
+    lib_valid_codes = lib_codes[lib_valid_ind[:-1]]
+    # library sequences which cannot be encoded (ie N bases) are matched as strings
+    lib_invalid = {seq:i for i, seq in enumerate(lib_seqs) if not lib_valid[i]}
+
     for fastq, _, _, _, _ in samples: 
         in_fastq = in_path / fastq
         assert os.path.exists(in_fastq), f"Error: {in_fastq} cannot be found."
+
+    # MATCH A BATCH OF GUIDES TO THE LIBRARY, ADDING TO counts_p AND list_np #
+    def match_guides(guides, counts_p, list_np): 
+        if len(guides) == 0: 
+            return 0, 0
+        codes, valid = encode_2bit(guides, length=20)
+        hits = lookup_2bit(codes[valid], lib_valid_codes)
+        ind = np.full(len(guides), -1, dtype=np.int64)
+        ind[valid] = lib_valid_ind[hits]
+        if lib_invalid: 
+            for i in np.flatnonzero(~valid): 
+                ind[i] = lib_invalid.get(guides[i], -1)
+        matched = ind >= 0
+        counts_p += np.bincount(ind[matched], minlength=len(counts_p))
+        list_np.extend(guides[i] for i in np.flatnonzero(~matched))
+        return int(matched.sum()), int((~matched).sum())
         
     for fastq, counts, nc, stats, cond in samples: 
         # FASTQ FILE OF READS AND PATH TO ALL OUTPUT FILES #
@@ -116,8 +144,9 @@ def count_reads(
         out_counts, out_nc, out_stats = outpath / counts, outpath / nc, outpath / stats
 
         # STEP 1B: SET UP VARIABLES FOR SCRIPT
-        dict_p = {sgRNA:0 for sgRNA in df_ref[sgRNA_seq_col]} # dictionary (sgRNA_seq:sgRNA_counts}
+        counts_p = np.zeros(len(lib_seqs), dtype=np.int64) # counts aligned with lib_seqs
         list_np = [] # list for non-perfect matches
+        guides = [] # guides waiting to be matched
         # reads count of: total, perfect match, non perfect match, no key found, not 20bps
         num_reads, num_p_matches, num_np_matches, num_nokey, num_badlength = 0, 0, 0, 0, 0
         KEY_START, KEY_END = KEY_INTERVAL[0], KEY_INTERVAL[1] # set the key interval
@@ -159,17 +188,18 @@ def count_reads(
             if len(guide) != 20:
                 num_badlength += 1
                 continue
-            if guide in dict_p:
-                dict_p[guide] += 1
-                num_p_matches += 1
-            else:
-                num_np_matches += 1
-                list_np.append(guide)
+            guides.append(guide)
+            if len(guides) >= batch_size: 
+                num_p, num_np = match_guides(guides, counts_p, list_np)
+                num_p_matches, num_np_matches = num_p_matches + num_p, num_np_matches + num_np
+                guides = []
+        num_p, num_np = match_guides(guides, counts_p, list_np)
+        num_p_matches, num_np_matches = num_p_matches + num_p, num_np_matches + num_np
     
         handle.close()
 
         # STEP 3: SORT PERF MATCH DICTIONARIES AND GENERATE OUTPUT FILES
-        df_perfects = pd.DataFrame(data=dict_p.items(), columns=[sgRNA_seq_col, cond])
+        df_perfects = pd.DataFrame({sgRNA_seq_col:lib_seqs, cond:counts_p})
         if save_files: 
             # OUTPUT PERFECT COUNTS #
             df_perfects.sort_values(by=cond, ascending=False, inplace=True)
@@ -206,12 +236,11 @@ def count_reads(
             # PERCENTAGE OF GUIDES THAT MATCH PERFECTLY #
             pct_p_match = round(num_p_matches/float(num_p_matches + num_np_matches) * 100, 1)
             # PERCENTAGE OF UNDETECTED GUIDES #
-            vals_p = np.fromiter(dict_p.values(), dtype=int)
-            guides_no_reads = np.count_nonzero(vals_p==0)
-            pct_no_reads = round(guides_no_reads/float(len(dict_p.values())) * 100, 1)
+            guides_no_reads = np.count_nonzero(counts_p==0)
+            pct_no_reads = round(guides_no_reads/float(len(counts_p)) * 100, 1)
             # SKEW RATIO TOP 10% TO BOTTOM 10% #
-            top_10 = np.percentile(list(dict_p.values()), 90)
-            bottom_10 = np.percentile(list(dict_p.values()), 10)
+            top_10 = np.percentile(counts_p, 90)
+            bottom_10 = np.percentile(counts_p, 10)
             if top_10 != 0 and bottom_10 != 0: skew_ratio = top_10/bottom_10
             else: skew_ratio = 'Not enough perfect matches to determine skew ratio'
             # CALCULATE NUMBER OF UNMAPPED READS #
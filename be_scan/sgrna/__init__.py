@@ -3,3 +3,10 @@ from be_scan.sgrna.generate_library import generate_library
 from be_scan.sgrna.annotate import annotate
 from be_scan.sgrna.reference_check import reference_check
 from be_scan.sgrna.coverage import coverage_plots
+from be_scan.sgrna.batch_library import batch_library
+from be_scan.sgrna.stream_library import stream_library, iter_library
+from be_scan.sgrna._gene_ import GeneForCRISPR
+from be_scan.sgrna._faidx_ import FastaIndex, build_fai
+from be_scan.sgrna._kmer_index_ import KmerIndex, build_kmer_index
+from be_scan.sgrna.isoform_library import isoform_library
+from be_scan.sgrna._offtarget_ import mismatch_counts
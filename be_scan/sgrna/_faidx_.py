@@ -0,0 +1,113 @@
+"""
+Author: Calvin XiaoYang Hu
+Date: 240610
+
+{Description: random access to a whole genome .fasta file through its samtools style .fai index, 
+sequences are sliced out of a memory mapped file so the genome is never read in full}
+"""
+
+import mmap
+from pathlib import Path
+
+# CLASS OBJECT TO FETCH REGIONS OF AN INDEXED .FASTA FILE #
+class FastaIndex(): 
+
+    # OPEN THE .FASTA FILE AND READ THE .fai INDEX #
+    # EACH .fai LINE IS: NAME, LENGTH, OFFSET, LINEBASES, LINEWIDTH #
+    def __init__(self, fasta_filepath, fai_filepath=None): 
+        self.fasta_filepath = Path(fasta_filepath)
+        if str(self.fasta_filepath).endswith('.gz'): 
+            raise Exception('Compressed .fasta files cannot be memory mapped, decompress the genome first')
+        self.fai_filepath = Path(fai_filepath) if fai_filepath else Path(str(self.fasta_filepath)+'.fai')
+        if not self.fai_filepath.exists(): 
+            raise Exception(f'{self.fai_filepath} not found, create it with samtools faidx or build_fai')
+
+        self.index = read_fai(self.fai_filepath)
+
+        self.file = open(self.fasta_filepath, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self): 
+        return self
+
+    def __exit__(self, *args): 
+        self.close()
+
+    def close(self): 
+        self.mm.close()
+        self.file.close()
+
+    # LENGTH OF A CHROMOSOME #
+    def length(self, chrom): 
+        return self.index[chrom][0]
+
+    # SEQUENCE OF chrom FROM start TO end, 1-BASED AND INCLUSIVE LIKE UCSC range= #
+    def fetch(self, chrom, start, end): 
+        if chrom not in self.index: 
+            raise Exception(f'{chrom} not found in {self.fai_filepath}')
+        length, offset, linebases, linewidth = self.index[chrom]
+        assert 1 <= start <= end <= length, f"{chrom}:{start}-{end} is outside of {chrom} (length {length})"
+        record = self.index[chrom]
+        raw = self.mm[fai_byte_pos(record, start-1):fai_byte_pos(record, end-1)+1]
+        return raw.replace(b'\n', b'').replace(b'\r', b'').decode('ascii')
+
+# READ A .fai INDEX #
+# OUTPUT: DICT OF {NAME:(LENGTH, OFFSET, LINEBASES, LINEWIDTH)} IN FILE ORDER #
+def read_fai(fai_filepath): 
+    index = {}
+    with open(fai_filepath, 'r') as f: 
+        for line in f: 
+            if not line.strip(): 
+                continue
+            name, length, offset, linebases, linewidth = line.split('\t')[:5]
+            index[name] = (int(length), int(offset), int(linebases), int(linewidth))
+    return index
+
+# BYTE POSITION OF THE 0-BASED BASE pos OF A RECORD, SKIPPING ONE NEWLINE PER FULL LINE #
+def fai_byte_pos(record, pos): 
+    length, offset, linebases, linewidth = record
+    return offset + (pos // linebases)*linewidth + pos % linebases
+
+def build_fai(fasta_filepath, fai_filepath=None): 
+    """[Summary]
+    Writes a samtools style .fai index of a .fasta file in one pass.
+    Every line of a record must be the same length except the last.
+
+    Parameters
+    ------------
+    fasta_filepath: str or path
+        The .fasta file to index
+    fai_filepath: str or path, default None
+        The output index, defaults to the .fasta file path plus .fai
+
+    Returns
+    ------------
+    fai_filepath : path
+        The path of the written index
+    """
+    fasta_filepath = Path(fasta_filepath)
+    fai_filepath = Path(fai_filepath) if fai_filepath else Path(str(fasta_filepath)+'.fai')
+
+    records = []
+    name, length, offset, linebases, linewidth = None, 0, 0, 0, 0
+    position = 0
+    with open(fasta_filepath, 'rb') as f: 
+        for line in f: 
+            if line.startswith(b'>'): 
+                if name is not None: 
+                    records.append((name, length, offset, linebases, linewidth))
+                name = line[1:].split()[0].decode('ascii')
+                length, offset, linebases, linewidth = 0, position+len(line), 0, 0
+            elif name is not None: 
+                bases = len(line.rstrip(b'\r\n'))
+                if linebases == 0: 
+                    linebases, linewidth = bases, len(line)
+                length += bases
+            position += len(line)
+    if name is not None: 
+        records.append((name, length, offset, linebases, linewidth))
+
+    with open(fai_filepath, 'w') as f: 
+        for record in records: 
+            f.write('\t'.join([str(x) for x in record]) + '\n')
+    return fai_filepath
@@ -7,63 +7,129 @@ This preprocessing includes separating intron and exons, and generating all poss
 """
 
 import re
+import os
+import json
+import hashlib
 import warnings
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 from pathlib import Path
-from be_scan.sgrna._genomic_ import complements, rev_complement
-# from _genomic_ import complements, rev_complement
+from be_scan.sgrna._genomic_ import complements, complement_lut, rev_complement, _rev_complement, process_PAM, validate_dna
+from be_scan.sgrna._guide_table_ import GuideTable
+from be_scan.sgrna._faidx_ import FastaIndex
+# from _genomic_ import complements, complement_lut, rev_complement, _rev_complement, process_PAM, validate_dna
+# from _guide_table_ import GuideTable
+# from _faidx_ import FastaIndex
+
+# BUMP WHEN THE PARSED STATE OR GUIDE ENUMERATION CHANGES SO OLD CACHE FILES ARE NOT USED #
+cache_version = 2
+# ATTRIBUTES SET BY parse_exons, extract_metadata, find_all_guides WHICH ARE SAVED IN THE CACHE #
+cache_attrs = ['exons_start', 'intron_len', 'exon_pads', 'chrID', 'strand', 'exon_metadata', 'n']
 
 # CLASS OBJECT NEEDED TO PARSE SPECIFIC INPUT INTRON/EXON .FASTA FORMAT #
 class GeneForCRISPR(): 
     
-    # READING THE .FASTA FILE INTO A STRING #
-    def __init__(self, filepath): 
+    # READING THE .FASTA FILE INTO A STRING, UNLESS file_content IS ALREADY GIVEN #
+    # metadata (dict) IS SET BY from_genome, SO THE HEADERS DO NOT HAVE TO BE PARSED #
+    def __init__(self, filepath, file_content=None, metadata=None): 
         self.filepath = Path(filepath)
-        f = open(self.filepath, "r")
-        self.file_content = f.read() # STRING
+        self.metadata = metadata
+        if file_content is None: 
+            f = open(self.filepath, "r")
+            file_content = f.read()
+        self.file_content = file_content # STRING
         self.guide_len = 20
 
         if len(self.file_content) == 0: 
             warnings.warn('Input file is empty.')
     
+    # BUILD A GENE FROM EXON COORDINATES IN AN INDEXED WHOLE GENOME .FASTA FILE #
+    # exons ARE (chrom, start, end) OF CODING EXONS, 1-BASED INCLUSIVE, IN ANY ORDER #
+    # EACH EXON IS FETCHED WITH pad INTRONIC BASES ON EACH SIDE, REV COMPLEMENTED FOR strand '-' #
+    # pad IS CUT SHORT AT THE ENDS OF THE CHROMOSOME, THE PADS OF EACH EXON ARE IN THE HEADER AND metadata #
+    # file_content IS THE SAME AS A UCSC GENOME BROWSER .FASTA FILE OF THE EXONS #
+    @classmethod
+    def from_genome(cls, genome_filepath, exons, strand='+', gene_name='gene', pad=20, fai_filepath=None): 
+        assert strand in ['+', '-'], "strand must be + or -"
+        assert len(exons) > 0, "Input at least one exon"
+        # EXONS IN ORDER OF TRANSCRIPTION #
+        exons = sorted(exons, key=lambda x: int(x[1]), reverse=(strand == '-'))
+        # AN OPEN FastaIndex CAN BE PASSED IN TO BUILD SEVERAL GENES FROM ONE GENOME #
+        genome = genome_filepath if isinstance(genome_filepath, FastaIndex) else FastaIndex(genome_filepath, fai_filepath)
+        records = []
+        metadata = {'chrID':exons[0][0], 'strand':'plus' if strand == '+' else 'minus', 
+                    'exon_metadata':{}, 'exon_pads':[]}
+        try: 
+            for k, (chrom, start, end) in enumerate(exons): 
+                start, end = int(start), int(end)
+                left, right = max(min(pad, start-1), 0), max(min(pad, genome.length(chrom)-end), 0)
+                seq = (genome.fetch(chrom, start-left, start-1).lower() if left > 0 else '') + \
+                      genome.fetch(chrom, start, end).upper() + \
+                      (genome.fetch(chrom, end+1, end+right).lower() if right > 0 else '')
+                pad5, pad3 = left, right
+                if strand == '-': 
+                    seq = _rev_complement(complements, seq)
+                    pad5, pad3 = right, left
+                records.append(f">{gene_name}_{k} range={chrom}:{start-left}-{end+right} " + 
+                               f"5'pad={pad5} 3'pad={pad3} strand={strand} repeatMasking=none\n{seq}")
+                metadata['exon_metadata'][k] = {'chromosome':chrom, 'start':str(start-left), 'end':str(end+right)}
+                metadata['exon_pads'].append([pad5, pad3])
+        finally: 
+            if genome is not genome_filepath: genome.close()
+        return cls(filepath=genome.fasta_filepath, file_content='\n'.join(records)+'\n', metadata=metadata)
+
     # PARSE SEPARATE EXONS, AND FIND WHERE INTRON/EXON BOUNDARIES ARE #
     # OUTPUT: NONE #
     # SAVES A LIST OF EXONS AND A LIST OF EXONS + INTRON ENDS #
     def parse_exons(self): 
-        exons_info, exons_extra = [], []
+        exons_info, exons_lines = [], []
         i = -1
-        # SPLIT FILE CONTENT INTO STRINGS, ADD TO LISTS #
+        # SPLIT FILE CONTENT INTO LINES, JOIN THE LINES OF EACH EXON ONCE #
         for line in self.file_content.split('\n'): 
             if len(line) > 0 and line[0] == '>': # TITLE LINE
-                exons_extra.append('')
+                exons_lines.append([])
                 exons_info.append(line)
                 i += 1
             else: # BASES LINE
-                exons_extra[i] += line
+                exons_lines[i].append(line)
+        exons_extra = [''.join(lines) for lines in exons_lines]
+        validate_dna(exons_extra, 'gene')
         # EXTRACT UPPERCASE (EXONS) and LOWERCASE (INTRONS) #
         exons, introns = [], []
         for exon in exons_extra: 
-            exons.append(''.join([base for base in exon if base.isupper()]))
-            introns.append((''.join([base for base in exon[:len(exon)//2] if base.islower()]), 
-                            ''.join([base for base in exon[len(exon)//2:] if base.islower()])))
+            exons.append(re.sub('[a-z]', '', exon))
+            introns.append((re.sub('[A-Z]', '', exon[:len(exon)//2]), re.sub('[A-Z]', '', exon[len(exon)//2:])))
 
         # CHECK INTRON LENGTHS CONSISTENT ACROSS FASTA FILE #
-        if not all([len(x) == len(y) for x, y in introns]): 
+        # A GENE FROM from_genome HAS THE PADS OF EACH EXON, WHICH ARE SHORTER AT THE ENDS OF A CHROMOSOME #
+        if self.metadata is None and not all([len(x) == len(y) for x, y in introns]): 
             print("Make sure 5' and 3' intron sequences are the same length")
         self.intron_len = len(introns[0][0])
+        if self.metadata is None: 
+            self.exon_pads = [[self.intron_len, self.intron_len] for _ in exons_extra]
+        else: 
+            self.exon_pads = self.metadata['exon_pads']
         
         # IDENTIFY START POSITION OF EACH EXON #
-        exons_start = []
-        for info in exons_info: 
-            exons_start.append(int(re.findall(r":(\d+)-", info)[0]))
+        if self.metadata is None: 
+            exons_start = []
+            for info in exons_info: 
+                exons_start.append(int(re.findall(r":(\d+)-", info)[0]))
+        else: 
+            exons_start = [int(m['start']) for m in self.metadata['exon_metadata'].values()]
         # SET INSTANCE VARIABLES #
         self.exons_extra, self.exons, self.exons_start = exons_extra, exons, exons_start
     
     # GENERATE ALL FWD AND REV GUIDES AND METADATA #
     # OUTPUT: NONE #
-    # SAVES GUIDE SEQ, INDEX OF FIRST BP IN CHROMOSOME, STARTING FRAME (0,1,2), EXON #
+    # SAVES A GuideTable PER STRAND OF GUIDE SEQ, INDEX OF FIRST BP IN CHROMOSOME, STARTING FRAME (0,1,2), EXON #
     ### conditional on introns being lowercase and exons being uppercase
-    def find_all_guides(self, window, n=23): 
+    # PAM (str) ONLY ENUMERATES GUIDES AT PAM SITES, ONLY USED WHEN vectorize IS True #
+    # shared (dict) IS PASSED TO iter_guides, ONLY USED WHEN vectorize IS True #
+    def find_all_guides(self, window, n=23, vectorize=True, PAM=None, shared=None): 
+        if vectorize: 
+            return self._find_all_guides_array(window, n, PAM, shared)
         assert len(self.exons_extra) > 0
         first_exon_utr_len = first_lowercase_length(self.exons_extra[0])
         last_exon_utr_len = first_lowercase_length(self.exons_extra[-1])
@@ -104,10 +170,8 @@ class GeneForCRISPR():
             prev_frame = (prev_frame+len(exon_extra)-(2*self.intron_len))%3
             prev_ind += len(exon_extra)-(2*self.intron_len)
 
-        # UPDATE INSTANCE VARIABLE #
-        self.fwd_guides = [g[1:10] for g in fwd_guides]
         # CALCULATE REV GUIDES FROM FWD GUIDES #
-        self.rev_guides = []
+        rev_guides = []
         for g in fwd_guides: 
             g_rev = [rev_complement(complements, g[0][3:]), rev_complement(complements, g[0][:3]), (g[3]+1)%3]
             if g_rev[0][0].islower(): g_rev.append(-1)
@@ -122,10 +186,172 @@ class GeneForCRISPR():
             else: g_rev.append((g[10]+self.n-1)-(window[1]-1))
 
             g_rev.append(g[11])
-            self.rev_guides.append(g_rev)
+            rev_guides.append(g_rev)
+
+        # UPDATE INSTANCE VARIABLES #
+        self.fwd_guides = GuideTable.from_rows('sense', [g[1:10] for g in fwd_guides])
+        self.rev_guides = GuideTable.from_rows('antisense', rev_guides)
+
+    # SAME OUTPUT AS find_all_guides, BUT EVERY OFFSET OF AN EXON IS COMPUTED AT ONCE #
+    def _find_all_guides_array(self, window, n=23, PAM=None, shared=None): 
+        self.fwd_guides = GuideTable.concat('sense', list(self.iter_guides(window, n, PAM, 'sense', shared=shared)))
+        self.rev_guides = GuideTable.concat('antisense', list(self.iter_guides(window, n, PAM, 'antisense', shared=shared)))
+
+    # YIELD GuideTable CHUNKS OF ONE STRAND (sense, antisense) IN EXON ORDER #
+    # EACH exons_extra STRING IS ENCODED ONCE AS A uint8 ARRAY #
+    # IF A PAM IS GIVEN, ONLY OFFSETS WITH A PAM ON THAT STRAND ARE MATERIALIZED #
+    # IF chunk_size IS GIVEN, EACH CHUNK HOLDS AT MOST chunk_size GUIDES, AND ONLY ONE CHUNK OF SEQUENCES IS BUILT AT A TIME #
+    # shared (dict) OF {(chrom, start, end, strand):{'seq':str}} HOLDS GENOMIC INTERVALS WHICH CONTAIN THE PADDED EXONS OF SEVERAL GENES #
+    # (ie ISOFORMS, SEE isoform_library), EACH INTERVAL IS SCANNED FOR PAM SITES ONCE AND THE SITES ARE PROJECTED ONTO EACH EXON #
+    def iter_guides(self, window, n=23, PAM=None, strand='sense', chunk_size=None, shared=None): 
+        assert len(self.exons_extra) > 0
+        self.n = n
+        # WINDOW INDICES INTO THE n-mer (NEGATIVE WINDOW BOUNDS WRAP LIKE STRING INDEXING) #
+        if window[1] >= n or window[1] >= self.guide_len: 
+            raise IndexError('string index out of range')
+        # PAM OF ALL N (ie SpRY) MATCHES EVERYWHERE, FALL BACK TO FULL ENUMERATION #
+        PAM_sites = None
+        if PAM is not None and set(PAM.upper()) != {'N'}: 
+            PAM_sites = re.compile('(?={})'.format(process_PAM(PAM).pattern))
+
+        utr_lens = first_lowercase_length(self.exons_extra[0]), first_lowercase_length(self.exons_extra[-1])
+        prev_frame, prev_ind = 0, 0
+        for e, exon_extra in enumerate(self.exons_extra): 
+            if len(exon_extra)-n-1 > 0: 
+                offsets = None
+                if shared is not None and PAM_sites is not None: 
+                    offsets = self._shared_offsets(e, shared, PAM_sites, n, strand)
+                for offsets, seqs in self._exon_chunks(exon_extra, PAM_sites, window, n, strand, chunk_size, offsets): 
+                    yield self._guides_at(offsets, seqs, len(exon_extra), e, prev_frame, prev_ind, window, n, strand, utr_lens)
+            prev_frame = (prev_frame+len(exon_extra)-sum(self.exon_pads[e]))%3
+            prev_ind += len(exon_extra)-sum(self.exon_pads[e])
+
+    # OFFSETS OF THE PAM SITES OF EXON e, FROM THE INTERVAL OF shared WHICH CONTAINS IT #
+    # THE INTERVAL IS SCANNED THE FIRST TIME ONE OF ITS EXONS IS ENUMERATED, THEN ITS SITES ARE SHIFTED BY THE EXON'S POSITION #
+    def _shared_offsets(self, e, shared, PAM_sites, n, strand): 
+        meta = self.exon_metadata[e]
+        chrom, start, end = meta['chromosome'], int(meta['start']), int(meta['end'])
+        gene_strand = '+' if self.strand == 'plus' else '-'
+        keys = [k for k in shared if k[0] == chrom and k[3] == gene_strand and k[1] <= start and end <= k[2]]
+        assert len(keys) > 0, f'no interval of shared contains exon {e} ({chrom}:{start}-{end})'
+        interval = shared[keys[0]]
+        scan_key = (strand, n, PAM_sites.pattern)
+        if scan_key not in interval: 
+            arr = np.frombuffer(interval['seq'].encode('ascii'), dtype=np.uint8)
+            interval[scan_key] = find_PAM_offsets(arr, PAM_sites, len(arr)-n-1, n, self.guide_len, strand)
+        # POSITION OF THE EXON IN THE INTERVAL, IN THE DIRECTION OF TRANSCRIPTION #
+        local = start-keys[0][1] if gene_strand == '+' else keys[0][2]-end
+        offsets = interval[scan_key]
+        return offsets[(offsets >= local) & (offsets < local+(end-start+1)-n-1)] - local
+
+    # YIELD (OFFSETS, SEQUENCES) OF THE n-mers OF ONE EXON, chunk_size OFFSETS AT A TIME #
+    # ONLY DEPENDS ON THE EXON SEQUENCE, NOT ON WHERE THE EXON IS IN THE GENE #
+    # offsets ARE THE PAM SITES OF THE EXON IF THEY ARE ALREADY KNOWN (SEE _shared_offsets) #
+    def _exon_chunks(self, exon_extra, PAM_sites, window, n, strand, chunk_size=None, offsets=None): 
+        arr = np.frombuffer(exon_extra.encode('ascii'), dtype=np.uint8)
+        count = len(exon_extra)-n-1
+        if offsets is None and PAM_sites is None: offsets = np.arange(count)
+        elif offsets is None: offsets = find_PAM_offsets(arr, PAM_sites, count, n, self.guide_len, strand)
+        lower = arr >= ord('a')
+        step = chunk_size if chunk_size else max(len(offsets), 1)
+        for c in range(0, len(offsets), step): 
+            yield offsets[c:c+step], self._exon_seqs(arr, lower, offsets[c:c+step], window, n, strand)
+
+    # SEQUENCES OF THE n-mers AT OFFSETS i OF AN ENCODED EXON, AND WHICH POSITION COLUMNS FALL ON LOWERCASE BASES #
+    def _exon_seqs(self, arr, lower, i, window, n, strand): 
+        g_len = self.guide_len
+        kmers = sliding_window_view(arr, n)[i]
+        # FWD GUIDES, n-mer IS [GUIDE, PAM] #
+        if strand == 'sense': 
+            seqs = {'sgRNA_seq':_to_bytes(kmers[:, :g_len]), 'PAM_seq':_to_bytes(kmers[:, g_len:]), 
+                    'gene_lower':lower[i], 'start_lower':lower[i+(window[0]-1) % n], 'end_lower':lower[i+window[1]]}
+        # REV GUIDES, REV COMPLEMENT OF n-mer IS [PAM, GUIDE] #
+        else: 
+            seqs = {'sgRNA_seq':_to_bytes(complement_lut[kmers[:, :n-g_len-1:-1]]), 
+                    'PAM_seq':_to_bytes(complement_lut[kmers[:, n-g_len-1::-1]]), 
+                    'gene_lower':lower[i+n-1], 'start_lower':lower[i+n-1-(window[0]-1) % g_len], 
+                    'end_lower':lower[i+n-1-window[1]]}
+        return seqs
+
+    # GuideTable OF THE n-mers STARTING AT OFFSETS i OF EXON e, WITH THEIR SEQUENCES FROM _exon_seqs #
+    def _guides_at(self, i, seqs, exon_len, e, prev_frame, prev_ind, window, n, strand, utr_lens): 
+        g_len = self.guide_len
+        last = e == len(self.exons_extra)-1
+
+        calc_pos = i-self.exon_pads[e][0]+prev_ind
+        frame = (i+prev_frame-self.exon_pads[e][0]) % 3
+        if self.strand == 'plus': ind_chr = self.exons_start[e]+i
+        if self.strand == 'minus': ind_chr = self.exons_start[e]-i
+
+        if strand == 'sense': 
+            utr = np.zeros(len(i), dtype=bool)
+            if e == 0: utr |= i < utr_lens[0]-window[0]+1
+            if last: utr |= i > exon_len-utr_lens[1]-window[1]
+            cols = [seqs['sgRNA_seq'], seqs['PAM_seq'], frame, 
+                    np.where(seqs['gene_lower'], -1, calc_pos), ind_chr, np.full(len(i), e), 
+                    np.where(seqs['start_lower'], -1, calc_pos+window[0]-1), 
+                    np.where(seqs['end_lower'], -1, calc_pos+window[1]-1), utr]
+        else: 
+            anti_utr = np.zeros(len(i), dtype=bool)
+            if e == 0: anti_utr |= i < utr_lens[0]+g_len-window[0]+1
+            if last: anti_utr |= i > exon_len-utr_lens[1]-g_len
+            rev_calc_pos = calc_pos+n-1
+            if self.strand == 'plus': rev_chr = ind_chr+n-1
+            if self.strand == 'minus': rev_chr = ind_chr-n+3
+            cols = [seqs['sgRNA_seq'], seqs['PAM_seq'], (frame+1) % 3, 
+                    np.where(seqs['gene_lower'], -1, rev_calc_pos), rev_chr, np.full(len(i), e), 
+                    np.where(seqs['start_lower'], -1, rev_calc_pos-(window[0]-1)), 
+                    np.where(seqs['end_lower'], -1, rev_calc_pos-(window[1]-1)), anti_utr]
+        return GuideTable(strand, dict(zip(GuideTable.fields, cols)))
+
+    # KEY OF THE CACHED GENE, A HASH OF THE FILE CONTENT AND THE ENUMERATION PARAMETERS #
+    def cache_key(self, window, n=23, PAM=None): 
+        params = json.dumps({'version':cache_version, 'window':list(window), 'n':n, 'PAM':PAM})
+        return hashlib.sha256((self.file_content + params).encode('utf-8')).hexdigest()
+
+    def cache_path(self, cache_dir, window, n=23, PAM=None): 
+        return Path(cache_dir) / f'{self.filepath.stem}_{self.cache_key(window, n, PAM)[:20]}.npz'
+
+    # SAVE THE PARSED GENE AND ITS GUIDES TO A .npz FILE IN cache_dir #
+    # OUTPUT: THE PATH OF THE .npz FILE #
+    def save_cache(self, cache_dir, window, n=23, PAM=None): 
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        filepath = self.cache_path(cache_dir, window, n, PAM)
+        state = {attr:getattr(self, attr) for attr in cache_attrs}
+        arrays = {'state':np.array(json.dumps(state)), 
+                  'exons_extra':np.array(self.exons_extra), 'exons':np.array(self.exons)}
+        for prefix, guides in [('fwd', self.fwd_guides), ('rev', self.rev_guides)]: 
+            for field in GuideTable.fields: 
+                arrays[f'{prefix}_{field}'] = guides[field]
+        # WRITE TO A TEMPORARY FILE FIRST SO A CACHE FILE IS NEVER HALF WRITTEN #
+        temp = filepath.with_suffix('.tmp.npz')
+        np.savez(temp, **arrays)
+        os.replace(temp, filepath)
+        return filepath
+
+    # LOAD THE PARSED GENE AND ITS GUIDES FROM cache_dir, REPLACES parse_exons, extract_metadata, find_all_guides #
+    # OUTPUT: True IF THE GENE WAS CACHED, False OTHERWISE #
+    def load_cache(self, cache_dir, window, n=23, PAM=None): 
+        filepath = self.cache_path(cache_dir, window, n, PAM)
+        if not filepath.exists(): 
+            return False
+        with np.load(filepath, allow_pickle=False) as arrays: 
+            state = json.loads(str(arrays['state']))
+            state['exon_metadata'] = {int(k):v for k, v in state['exon_metadata'].items()}
+            for attr in cache_attrs: 
+                setattr(self, attr, state[attr])
+            self.exons_extra, self.exons = arrays['exons_extra'].tolist(), arrays['exons'].tolist()
+            self.fwd_guides = GuideTable('sense', {f:arrays[f'fwd_{f}'] for f in GuideTable.fields})
+            self.rev_guides = GuideTable('antisense', {f:arrays[f'rev_{f}'] for f in GuideTable.fields})
+        return True
 
     # EXTRACT METADATA ABOUT CHROMOSOME POSITION, STRAND #
+    # A GENE FROM from_genome ALREADY HAS IT, SO ANY CHROMOSOME NAME (ie 7, MT, chrUn_...) WORKS #
     def extract_metadata(self): 
+        if self.metadata is not None: 
+            self.chrID, self.strand = self.metadata['chrID'], self.metadata['strand']
+            self.exon_metadata = dict(self.metadata['exon_metadata'])
+            return
         all_lines = self.file_content.split('\n')
         first_line = all_lines[0]
         try: 
@@ -148,6 +374,22 @@ class GeneForCRISPR():
                 exon_metadata = {'chromosome':chr_id, 'start':start, 'end':end}
                 self.exon_metadata[i] = exon_metadata
 
+def find_PAM_offsets(arr, PAM_sites, count, n, guide_len, strand='sense'): 
+    """
+    Scans a uint8 encoded exon (sense) or its reverse complement (antisense) for PAM sites in one pass, 
+    returns the offsets of the n-mers which have a PAM on that strand
+    """
+    PAM_len = n-guide_len
+    # FWD PAM STARTS AFTER THE GUIDE #
+    if strand == 'sense': 
+        fwd_seq = arr.tobytes().decode('ascii')
+        offsets = np.array([m.start()-guide_len for m in PAM_sites.finditer(fwd_seq, guide_len)], dtype=int)
+    # REV PAM IS THE REV COMPLEMENT OF THE FIRST BASES OF THE n-mer #
+    else: 
+        rev_seq = complement_lut[arr[::-1]].tobytes().decode('ascii')
+        offsets = np.array([len(arr)-PAM_len-m.start() for m in PAM_sites.finditer(rev_seq)], dtype=int)[::-1]
+    return offsets[(offsets >= 0) & (offsets < count)]
+
 def first_lowercase_length(sequence):
     match = re.match(r"[a-z]+", sequence)
     return len(match.group()) if match else 0
@@ -155,3 +397,10 @@ def first_lowercase_length(sequence):
 def last_lowercase_length_regex(sequence):
     match = re.search(r"[a-z]+$", sequence)
     return len(match.group()) if match else 0
+
+def _to_bytes(kmers): 
+    """
+    Converts a 2D uint8 array of bases into a 1D fixed-width byte array, one sequence per row
+    """
+    kmers = np.ascontiguousarray(kmers)
+    return kmers.view(f'S{kmers.shape[1]}').ravel()
@@ -7,6 +7,8 @@ many of these would be included in bioconda etc but I'm writing these out to avo
 """
 
 import re
+import numpy as np
+import pandas as pd
 from pathlib import Path
 
 # VARIABLES
@@ -32,6 +34,11 @@ DNA_AA_map = {"TTT":"F", "TTC":"F", "TTA":"L", "TTG":"L",
 bases = 'ACGT'
 complements = {'A':'T', 'T':'A', 'G':'C', 'C':'G', 
                    'a':'t', 't':'a', 'g':'c', 'c':'g'}
+# lookup table for complementing uint8 encoded sequences, other characters are unchanged
+complement_lut = np.arange(256, dtype=np.uint8)
+for base, comp in complements.items(): 
+    complement_lut[ord(base)] = ord(comp)
+complements_table = str.maketrans(complements)
 
 
 
@@ -50,37 +57,49 @@ cas_key = {'Sp': 'NGG',
 # translate DNA sequence to amino acid sequence
 def DNA_to_AA(seq, upper=True): 
     assert isinstance(seq, str)
-    assert all(c in 'acgtACGT' for c in seq)
-    assert len(seq) % 3 == 0
-    aa_seq = ''
-    for i in range(len(seq)//3): 
-        codon = seq[(i*3):(i*3)+3] #.replace("T", "U")
-        # if upper is False, we do not translate lowercase letters
-        if upper: 
-            codon = codon.upper()
-        if not codon.isupper(): 
-            aa_seq += '_'
-            continue
-        aa_seq += DNA_AA_map[codon]
-    return aa_seq
+    assert not seq.strip('acgtACGT')
+    return _DNA_to_AA(seq, upper)
 
 # find the reverse complement of a DNA sequence
 def rev_complement(complements, seq): 
     assert isinstance(seq, str)
-    assert all(c in 'acgtACGT' for c in seq)
-    compl = ''
-    for i in range(len(seq)): 
-        compl += complements[seq[i]]
-    return compl[::-1]
+    assert not seq.strip('acgtACGT')
+    return _rev_complement(complements, seq)
 
 # find the complement of a DNA sequence
 def complement(complements, seq): 
     assert isinstance(seq, str)
-    assert all(c in 'acgtACGT' for c in seq)
-    compl = ''
-    for i in range(len(seq)): 
-        compl += complements[seq[i]]
-    return compl
+    assert not seq.strip('acgtACGT')
+    return _complement(complements, seq)
+
+# UNCHECKED VERSIONS OF THE ABOVE, FOR SEQUENCES ALREADY CHECKED BY validate_dna OR READ FROM A GENOME #
+# CODONS WHICH ARE NOT ALL UPPERCASE ACGT TRANSLATE TO '_', OTHER CHARACTERS (ie N) ARE NOT COMPLEMENTED #
+def _DNA_to_AA(seq, upper=True): 
+    assert len(seq) % 3 == 0
+    # if upper is False, we do not translate lowercase letters
+    if upper: 
+        seq = seq.upper()
+    return ''.join([DNA_AA_map.get(seq[i:i+3], '_') for i in range(0, len(seq), 3)])
+
+def _rev_complement(complements, seq): 
+    return seq.translate(complement_table(complements))[::-1]
+
+def _complement(complements, seq): 
+    return seq.translate(complement_table(complements))
+
+# str.translate table for a dict of complements, the default complements table is built once
+def complement_table(comps): 
+    if comps is complements: 
+        return complements_table
+    return str.maketrans(comps)
+
+# check that sequences only contain ACGT bases, call once where sequences enter the package
+def validate_dna(seqs, name='sequence'): 
+    if isinstance(seqs, str): 
+        seqs = [seqs]
+    for seq in seqs: 
+        assert isinstance(seq, str), f"{name} {seq} is not a string"
+        assert not seq.strip('acgtACGT'), f"{name} {seq} contains bases other than ACGT"
 
 # take in a protein .fasta file and extract the protein sequence
 def protein_to_AAseq(filename): 
@@ -94,6 +113,11 @@ def protein_to_AAseq(filename):
     dic[len(seq)+1] = '.'
     return dic
 
+# SAME AS protein_to_AAseq BUT AS AN ARRAY INDEXED BY POSITION, INDEX 0 IS EMPTY #
+def protein_to_AAarray(filename): 
+    dic = protein_to_AAseq(filename)
+    return np.array(['']+[dic[i] for i in range(1, len(dic)+1)])
+
 # function to change a PAM sequence into a regex sequence
 def process_PAM(PAM): 
     assert isinstance(PAM, str)
@@ -120,3 +144,94 @@ def last_capital_index(sequence):
         if sequence[i].isupper():
             return i
     raise Exception("Last exon has no coding sequences")
+
+# 2-BIT PACKED SEQUENCES
+# A=0 C=1 G=2 T=3, the first base is the most significant, up to 32 bases fit in a uint64
+# case is not kept, any other character makes a sequence invalid
+
+base_to_2bit = np.full(256, 255, dtype=np.uint8)
+for i, base in enumerate(bases): 
+    base_to_2bit[ord(base)] = i
+    base_to_2bit[ord(base.lower())] = i
+bases_2bit = np.frombuffer(bases.encode('ascii'), dtype=np.uint8)
+
+# turn a list/array/Series of sequences of the same length into a 2D uint8 array, one row per sequence
+def seqs_to_matrix(seqs, length=None): 
+    seqs = np.asarray(seqs)
+    if seqs.dtype.kind != 'S': 
+        seqs = np.char.encode(seqs.astype(str), 'ascii')
+    if length is None: 
+        length = seqs.dtype.itemsize
+    seqs = np.ascontiguousarray(seqs.astype(f'S{length}'))
+    return seqs.view(np.uint8).reshape(len(seqs), length)
+
+# encode sequences of length k <= 32 into uint64, returns the codes and a mask of valid sequences
+# sequences that are not length k or have non ACGT characters are invalid, their code is 0
+def encode_2bit(seqs, length=None): 
+    mat = seqs_to_matrix(seqs, length)
+    length = mat.shape[1]
+    assert length <= 32, "Sequences must be 32 bases or shorter"
+    digits = base_to_2bit[mat]
+    valid = (digits != 255).all(axis=1)
+    # LONGER SEQUENCES ARE TRUNCATED TO length BY seqs_to_matrix #
+    if not isinstance(seqs, np.ndarray) or seqs.dtype.kind != 'S': 
+        valid &= np.fromiter((len(s) == length for s in seqs), dtype=bool, count=len(mat))
+    codes = np.zeros(len(mat), dtype=np.uint64)
+    for j in range(length): 
+        codes = (codes << np.uint64(2)) | digits[:, j].astype(np.uint64)
+    codes[~valid] = 0
+    return codes, valid
+
+# decode uint64 codes back into uppercase sequences of length k
+def decode_2bit(codes, length): 
+    codes = np.asarray(codes, dtype=np.uint64)
+    shifts = np.arange(2*(length-1), -1, -2, dtype=np.uint64)
+    digits = (codes[:, None] >> shifts) & np.uint64(3)
+    mat = np.ascontiguousarray(bases_2bit[digits])
+    return mat.view(f'S{length}').ravel().astype(str)
+
+# reverse complement uint64 codes of length k
+def rev_complement_2bit(codes, length): 
+    codes = np.asarray(codes, dtype=np.uint64) ^ np.uint64((1 << (2*length))-1) # COMPLEMENT IS 3-x
+    rev = np.zeros(len(codes), dtype=np.uint64)
+    for _ in range(length): 
+        rev = (rev << np.uint64(2)) | (codes & np.uint64(3))
+        codes = codes >> np.uint64(2)
+    return rev
+
+# boolean mask of sequences which appear more than once, same as Series.duplicated(keep=False)
+# case sensitive, falls back to pandas if any sequence cannot be encoded
+def duplicated_seqs(seqs): 
+    seqs = np.asarray(seqs)
+    if len(seqs) == 0: 
+        return np.zeros(0, dtype=bool)
+    if seqs.dtype.kind not in 'SU': 
+        seqs = seqs.astype(str)
+    lengths = np.char.str_len(seqs)
+    if lengths.min() != lengths.max() or lengths.max() > 32: 
+        return pd.Series(seqs).duplicated(keep=False).to_numpy()
+    mat = seqs_to_matrix(seqs)
+    codes, valid = encode_2bit(mat.view(f'S{mat.shape[1]}').ravel())
+    if not valid.all(): 
+        return pd.Series(seqs).duplicated(keep=False).to_numpy()
+    # LOWERCASE (INTRON) BASES ARE KEPT AS A SECOND KEY #
+    cases = np.zeros(len(mat), dtype=np.uint64)
+    for j in range(mat.shape[1]): 
+        cases = (cases << np.uint64(1)) | (mat[:, j] >= ord('a')).astype(np.uint64)
+    if cases.any(): 
+        _, inverse, counts = np.unique(np.stack([codes, cases], axis=1), axis=0, 
+                                       return_inverse=True, return_counts=True)
+    else: 
+        _, inverse, counts = np.unique(codes, return_inverse=True, return_counts=True)
+    return counts[inverse.reshape(-1)] > 1
+
+# index of each query code in the reference codes, -1 if not found
+# reference codes should be unique, lookups are a binary search of the sorted reference
+def lookup_2bit(query_codes, ref_codes): 
+    if len(ref_codes) == 0: 
+        return np.full(len(query_codes), -1, dtype=np.int64)
+    order = np.argsort(ref_codes, kind='stable')
+    sorted_ref = ref_codes[order]
+    pos_clipped = np.minimum(np.searchsorted(sorted_ref, query_codes), len(sorted_ref)-1)
+    found = sorted_ref[pos_clipped] == query_codes
+    return np.where(found, order[pos_clipped], -1)
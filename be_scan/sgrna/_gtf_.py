@@ -0,0 +1,97 @@
+"""
+Author: Calvin XiaoYang Hu
+Date: 240610
+
+{Description: reads the coding exons of each transcript of a gene from a .gtf or .gff3 annotation file}
+"""
+
+import re
+import gzip
+from pathlib import Path
+
+# READ THE CODING EXONS OF EACH TRANSCRIPT OF gene #
+# OUTPUT: DICT OF {transcript_id: {'chrom':str, 'strand':str, 'exons':[(chrom, start, end), ...]}} #
+# gene IS MATCHED TO gene_name OR gene_id (WITH OR WITHOUT VERSION), COORDINATES ARE 1-BASED INCLUSIVE #
+# RAISES AN EXCEPTION IF NO LINE MATCHES gene, OR IF gene HAS NO CODING TRANSCRIPTS #
+# stop_codon FEATURES (.gtf) ARE ADDED TO THE CDS SO EACH TRANSCRIPT ENDS WITH ITS STOP CODON #
+def read_transcripts(annotation_filepath, gene, transcript_ids=None): 
+    annotation_filepath = Path(annotation_filepath)
+    handle = gzip.open(annotation_filepath, 'rt') if str(annotation_filepath).endswith('.gz') else open(annotation_filepath, 'r')
+
+    cds = {} # transcript_id: [(chrom, strand, start, end), ...]
+    gff_genes, gff_transcripts = set(), {} # FOR .gff3, gene IDs AND {transcript ID: gene ID}
+    is_gff, gene_found = False, False
+    with handle: 
+        for line in handle: 
+            if line.startswith('#') or not line.strip(): 
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9: 
+                continue
+            chrom, feature, start, end, strand, attributes = fields[0], fields[2], fields[3], fields[4], fields[6], fields[8]
+            attrs = parse_attributes(attributes)
+
+            if feature not in ['CDS', 'stop_codon']: 
+                gene_found |= matches_gene(attrs, gene)
+                # .gff3 GENES AND TRANSCRIPTS ARE LINKED TO CDS THROUGH ID AND Parent #
+                if 'ID' in attrs: 
+                    if matches_gene(attrs, gene): 
+                        gff_genes.add(attrs['ID'])
+                    if 'Parent' in attrs: 
+                        gff_transcripts[attrs['ID']] = attrs['Parent']
+                continue
+            if 'transcript_id' in attrs and 'Parent' not in attrs: # .gtf
+                if not matches_gene(attrs, gene): 
+                    continue
+                gene_found = True
+                tids = [attrs['transcript_id']]
+            else: # .gff3, CDS MAY HAVE SEVERAL PARENT TRANSCRIPTS
+                is_gff = True
+                tids = attrs.get('Parent', '').split(',')
+            for tid in tids: 
+                cds.setdefault(tid, []).append((chrom, strand, int(start), int(end)))
+
+    if not gene_found: 
+        raise Exception(f'{gene} not found in {annotation_filepath}, input a gene_name, gene_id, Name or ID')
+    # FOR .gff3 KEEP TRANSCRIPTS WHOSE PARENT IS THE GENE #
+    if is_gff: 
+        cds = {tid:v for tid, v in cds.items() if gff_transcripts.get(tid) in gff_genes}
+    # DROP ID PREFIXES (ie transcript:ENST...) #
+    cds = {tid.split(':')[-1]:v for tid, v in cds.items()}
+    if transcript_ids is not None: 
+        missing = [tid for tid in transcript_ids if tid not in cds]
+        if missing: 
+            raise Exception(f'Transcripts {missing} of {gene} not found in {annotation_filepath}')
+        cds = {tid:cds[tid] for tid in transcript_ids}
+    if len(cds) == 0: 
+        raise Exception(f'No coding transcripts of {gene} found in {annotation_filepath}')
+
+    transcripts = {}
+    for tid, intervals in cds.items(): 
+        chroms, strands = set([x[0] for x in intervals]), set([x[1] for x in intervals])
+        assert len(chroms) == 1 and len(strands) == 1, f"{tid} has CDS on several chromosomes or strands"
+        chrom, strand = chroms.pop(), strands.pop()
+        transcripts[tid] = {'chrom':chrom, 'strand':strand, 
+                            'exons':[(chrom, s, e) for s, e in merge_intervals([x[2:] for x in intervals])]}
+    return transcripts
+
+# PARSE THE ATTRIBUTES COLUMN OF A .gtf (key "value";) OR .gff3 (key=value;) LINE #
+def parse_attributes(attributes): 
+    if '="' not in attributes and re.search(r'\w "', attributes): 
+        return dict(re.findall(r'(\S+) "([^"]*)"', attributes))
+    return dict([kv.strip().split('=', 1) for kv in attributes.split(';') if '=' in kv])
+
+def matches_gene(attrs, gene): 
+    names = [attrs.get(key, '') for key in ['gene_name', 'gene_id', 'Name', 'ID', 'gene']]
+    names += [name.split('.')[0] for name in names] + [name.split(':')[-1] for name in names]
+    return gene in names
+
+# SORT AND MERGE OVERLAPPING OR TOUCHING (start, end) INTERVALS #
+def merge_intervals(intervals): 
+    merged = []
+    for start, end in sorted(intervals): 
+        if merged and start <= merged[-1][1]+1: 
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else: 
+            merged.append((start, end))
+    return merged
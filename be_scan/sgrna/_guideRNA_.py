@@ -5,12 +5,18 @@ Date: 231102
 {Description: helper functions for processing guides and library data}
 """
 
-import warnings
 import re
 
+import numpy as np
+import pandas as pd
 from itertools import product
-from be_scan.sgrna._genomic_ import complements, rev_complement, DNA_to_AA
-# from _genomic_ import complements, rev_complement, DNA_to_AA
+from functools import lru_cache
+from be_scan.sgrna._genomic_ import complements, rev_complement, DNA_to_AA, DNA_AA_map
+from be_scan.sgrna._sequence_ import rev_complement_seqs, DNA_to_AA_seqs
+from be_scan.sgrna._guide_table_ import GuideTable
+# from _genomic_ import complements, rev_complement, DNA_to_AA, DNA_AA_map
+# from _sequence_ import rev_complement_seqs, DNA_to_AA_seqs
+# from _guide_table_ import GuideTable
 
 # FUNCTIONS FOR generate_library #
 
@@ -84,7 +90,12 @@ def filter_guide(g, PAM_regex, edit, window, excl_introns, excl_nonediting):
     ------------
     excl_introns : bool, whether or not the editible base needs to be in an exon
     excl_nonediting : bool, whether or not the editible base needs to be present in the window
+
+    If g is a GuideTable, returns a boolean mask over all of its guides. 
     """
+    if isinstance(g, GuideTable): 
+        return g.match_PAM(PAM_regex) & filter_edit(g, edit, window, excl_introns, excl_nonediting)
+
     window_seq = g[0][window[0]-1:window[1]]
     if not excl_nonediting: 
         edit_in_window = True
@@ -94,10 +105,24 @@ def filter_guide(g, PAM_regex, edit, window, excl_introns, excl_nonediting):
         edit_in_window = (edit[0].upper() in window_seq.upper())
     return (True if PAM_regex.match(g[1]) else False) and edit_in_window
 
+def filter_edit(g, edit, window, excl_introns, excl_nonediting): 
+    """
+    Boolean mask over a GuideTable of guides with the target residue within its window, 
+    the part of filter_guide which does not depend on the PAM
+    """
+    if not excl_nonediting: 
+        return np.ones(len(g), dtype=bool)
+    elif excl_introns: 
+        return g.contains(edit[0], window[0]-1, window[1])
+    else: 
+        return g.contains(edit[0].upper(), window[0]-1, window[1], upper=True)
+
 def filter_sequence(results, sequence): 
     """
     Delete guides with TTTT which is a stop sequence for cloning
     """
+    if isinstance(results, GuideTable): 
+        return results.subset(~results.contains(sequence, upper=True))
     results = [r for r in results if not (sequence in r[0].upper())]
     return results
 
@@ -142,22 +167,180 @@ def calc_coding_window(row, window, col_names):
     return rev_complement(complements, row[seq_col][window[0]-1:window[1]]), int(start-window[0])
 
 
-def annotate_muts(row, edit, amino_acid_seq, col_names, pre, window, exons): 
+# COLUMN FUNCTIONS FOR annotate, SAME AS THE ROW FUNCTIONS BUT FOR WHOLE COLUMNS #
+# seqs, frame ARE COLUMNS, sense IS A BOOLEAN MASK OF sense GUIDES #
+# coding IS A BOOLEAN MASK OF GUIDES WITH CODING DNA IN THE WINDOW, OTHER GUIDES GET None #
+
+def win_overlap_col(coding_seq, sense, window): 
     """
-    Come up with list of annotations (ie F877L;F877P) for each guide
+    Where the window sits (Exon, Exon/Intron, Intron) for each guide, 
+    same as annotate_intron_exon for sense and annotate_intron_exon_anti for antisense guides
     """
-    frame_col, strand_col, gene_pos_col, seq_col, window_start_col, window_end_col = col_names
+    coding_seq = pd.Series(np.asarray(coding_seq, dtype=object))
+    wind = pd.Series(np.where(sense, coding_seq.str.slice(window[0]-1, window[1]), 
+                                     coding_seq.str.slice(20-window[1], 20-window[0]+1)))
+    return np.select([wind.str.isupper().to_numpy(dtype=bool), wind.str.islower().to_numpy(dtype=bool)], 
+                     ['Exon', 'Intron'], 'Exon/Intron').astype(object)
 
-    if row[window_start_col] == -1 and row[window_end_col] == -1: # NO CODING DNA IN WINDOW
-        return None
-    
-    # EXTRACT DATA FROM ROW #
-    frame, dir, pos, seq = row[frame_col], row[strand_col], row[gene_pos_col], row[seq_col]
+def edit_count_col(seqs, edit_from, window): 
+    """
+    Number of bases of edit_from in the window of each guide
+    """
+    wind = pd.Series(np.asarray(seqs, dtype=object)).str.slice(window[0]-1, window[1])
+    return sum([wind.str.count(e) for e in edit_from]).to_numpy()
+
+def calc_coding_window_cols(seqs, sense, frame, coding, window): 
+    """
+    Same as calc_coding_window for a column of guides, 
+    returns the target_CDS and target_windowpos columns
+    """
+    seqs, frame = np.asarray(seqs, dtype=object), np.asarray(frame)
+    wind = pd.Series(seqs).str.slice(window[0]-1, window[1]).to_numpy(dtype=object)
+    wind[~sense] = rev_complement_seqs(wind[~sense])
+    windowpos = np.where(sense, window[0]-4+frame, frame+1-window[0]).astype(object)
+    wind[~coding], windowpos[~coding] = None, None
+    return wind, windowpos
+
+def calc_target_cols(seqs, sense, frame, coding, window): 
+    """
+    Same as calc_target for a column of guides, one slice per strand and frame, 
+    returns the codon_window and residue_window columns
+    """
+    seqs, frame = np.asarray(seqs, dtype=object), np.asarray(frame)
+    num_aa = int(2+((window[1]-window[0]-1)//3))
+    dna, aa = np.full(len(seqs), None, dtype=object), np.full(len(seqs), None, dtype=object)
+    for strand_mask, is_sense in [(sense, True), (~sense, False)]: 
+        for f in np.unique(frame[coding & strand_mask]): 
+            rows = coding & strand_mask & (frame == f)
+            start = int(-1*f)+3 if is_sense else int(f)+1
+            dna_rows = pd.Series(seqs[rows]).str.slice(start, start+(num_aa*3)).to_numpy(dtype=object)
+            if not is_sense: 
+                dna_rows = rev_complement_seqs(dna_rows)
+            dna[rows], aa[rows] = dna_rows, DNA_to_AA_seqs(dna_rows, upper=False)
+    return dna, aa
+
+# PRECOMPILED PATTERNS FOR THE COLUMN FUNCTIONS OF muttypes AND muttype #
+# A MUTATION (ie F877L) IS Silent IF IT STARTS AND ENDS WITH THE SAME AMINO ACID, Nonsense IF IT ENDS IN A STOP #
+silent_pattern = re.compile(r'(?<![^;/])([^;/])(?:[^;/]*\1)?(?![^;/])')
+nonsense_pattern = re.compile(r'(?<![^;/])(?!Silent(?![^;/]))[^;/]*\.(?![^;/])')
+missense_pattern = re.compile(r'(?<![^;/])(?!(?:Silent|Nonsense)(?![^;/]))[^;/]+(?![^;/])')
+# SPLICE SITE PATTERNS, SEE is_splice_acceptor_guide AND is_splice_donor_guide #
+splice_patterns = {key:re.compile(pattern) for key, pattern in [
+    ('acceptor_sense', r'^[a-z]+ag[A-Z]+$'), ('acceptor_antisense', r'^[A-Z]+ct[a-z]+$'), 
+    ('donor_sense', r'^[A-Z]*gt[a-z]*$'), ('donor_antisense', r'^[a-z]*ac[A-Z]*$'), 
+    ('ag', r'^[a-z]*ag[A-Z]*$'), ('ct', r'^[A-Z]*ct[a-z]*$'), ('gt', r'^[A-Z]*gt[a-z]*$'), ('ac', r'^[a-z]*ac[A-Z]*$'), 
+    ('a_end', r'^[a-z]*a$'), ('g_start', r'^g[A-Z]*$'), ('t_start', r'^t[a-z]*$'), 
+    ('c_end', r'^[A-Z]*c$'), ('g_end', r'^[A-Z]*g$'), ('c_start', r'^c[A-Z]*$'), ]}
+
+def determine_mutations_col(mutations, coding): 
+    """
+    Same as determine_mutations for a column of mutations, 
+    each mutation is replaced by its type (Silent, Nonsense, Missense)
+    """
+    types = pd.Series(np.asarray(mutations, dtype=object)).fillna('')
+    types = types.str.replace(silent_pattern, 'Silent', regex=True)
+    types = types.str.replace(nonsense_pattern, 'Nonsense', regex=True)
+    types = types.str.replace(missense_pattern, 'Missense', regex=True).to_numpy(dtype=object)
+    types[~np.asarray(coding, dtype=bool)] = None
+    return types
+
+def splice_site_cols(seqs, sense, edit_from, window): 
+    """
+    Same as is_splice_acceptor_guide and is_splice_donor_guide for a column of guides, 
+    returns boolean arrays of splice-acceptor and splice-donor guides
+    """
+    seqs = pd.Series(np.asarray(seqs, dtype=object))
+    wind = seqs.str.slice(window[0]-1, window[1])
+    def match(s, key): 
+        return s.str.match(splice_patterns[key]).fillna(False).to_numpy(dtype=bool)
+    # THE BASE RIGHT AFTER THE WINDOW AND THE ONE AFTER THAT #
+    upper1, lower1 = seqs.str.get(window[1]).str.isupper().fillna(False).to_numpy(dtype=bool), seqs.str.get(window[1]).str.islower().fillna(False).to_numpy(dtype=bool)
+    upper2, lower2 = seqs.str.get(window[1]+1).str.isupper().fillna(False).to_numpy(dtype=bool), seqs.str.get(window[1]+1).str.islower().fillna(False).to_numpy(dtype=bool)
+    A, C, G, T = [base in edit_from for base in 'ACGT']
+
+    acceptor_sense = match(seqs, 'acceptor_sense') & (
+        ((A or G) & match(wind, 'ag') & upper1) | (A & match(wind, 'a_end') & upper2) | (G & match(wind, 'g_start') & upper2))
+    acceptor_antisense = match(seqs, 'acceptor_antisense') & (
+        ((T or C) & match(wind, 'ct') & lower1) | (T & match(wind, 't_start') & lower2) | (C & match(wind, 'c_end') & lower2))
+    donor_sense = match(seqs, 'donor_sense') & (
+        ((T or G) & match(wind, 'gt') & lower1) | (T & match(wind, 't_start') & lower2) | (G & match(wind, 'g_end') & lower2))
+    donor_antisense = match(seqs, 'donor_antisense') & (
+        ((A or C) & match(wind, 'ac') & upper1) | (A & match(wind, 'a_end') & upper2) | (C & match(wind, 'c_start') & upper2))
+    return np.where(sense, acceptor_sense, acceptor_antisense), np.where(sense, donor_sense, donor_antisense)
+
+def categorize_mutations_col(seqs, sense, muttypes, utr, edit_from, window): 
+    """
+    Same as categorize_mutations for a column of guides, 
+    by priority: Splice-acceptor, Splice-donor, Nonsense, Missense, Silent, UTR, Intron, No Mutation
+    """
+    seqs = pd.Series(np.asarray(seqs, dtype=object))
+    muttypes = pd.Series(np.asarray(muttypes, dtype=object))
+    acceptor, donor = splice_site_cols(seqs, sense, edit_from, window)
+    def has(muttype): 
+        return muttypes.str.contains(muttype, regex=False).fillna(False).to_numpy(dtype=bool)
+    wind = seqs.str.slice(window[0]-1, window[1])
+    noncoding = (wind.str.contains('[a-z]', regex=True) & wind.str.contains(edit_from.lower(), regex=False)).to_numpy(dtype=bool)
+    utr = np.asarray(utr, dtype=object) == True
+
+    return np.select([acceptor, donor, has('Nonsense'), has('Missense'), has('Silent'), noncoding & utr, noncoding], 
+                     ['Splice-acceptor', 'Splice-donor', 'Nonsense', 'Missense', 'Silent', 'UTR', 'Intron'], 
+                     'No Mutation').astype(object)
+
+# CATEGORIES OF THE LONG FORMAT MUTATION TABLE #
+aa_categories = sorted(set(DNA_AA_map.values())) + ['_']
+mut_categories = ['Missense', 'Nonsense', 'Silent']
+
+def mutation_table_col(mutations, editor): 
+    """
+    Long format table of a column of mutations (ie F877L/F877P;F877S), one row per guide, outcome and residue, 
+    with the int64 row position of the guide, int32 outcomes and residues and categorical amino acids and muttypes
+    """
+    muts = pd.Series(np.asarray(mutations, dtype=object)).fillna('')
+    # outcome IS THE INDEX OF THE ; SEPARATED OUTCOME WITHIN ITS GUIDE #
+    muts = muts[muts != ''].str.split(';').explode()
+    residues = pd.DataFrame({'guide':muts.index.to_numpy(dtype=np.int64), 
+                             'outcome':muts.groupby(level=0, sort=False).cumcount().to_numpy(), 
+                             'mutation':muts.str.split('/').to_numpy(), })
+    residues = residues.explode('mutation', ignore_index=True)
+    parts = residues['mutation'].astype(str).str.extract(r'^(\D)(\d+)(\D)$')
+    ref, alt = parts[0].to_numpy(dtype=object), parts[2].to_numpy(dtype=object)
+
+    return pd.DataFrame({
+        'guide':residues['guide'].to_numpy(dtype=np.int64), 
+        'editor':pd.Categorical([editor]*len(residues)), 
+        'outcome':residues['outcome'].to_numpy(dtype=np.int32), 
+        'residue':parts[1].to_numpy(dtype=np.int32), 
+        'ref_aa':pd.Categorical(ref, categories=aa_categories), 
+        'alt_aa':pd.Categorical(alt, categories=aa_categories), 
+        'muttype':pd.Categorical(np.select([ref == alt, alt == '.'], ['Silent', 'Nonsense'], 'Missense'), categories=mut_categories), 
+        })
+
+def verify_protein_col(residue, ref_aa, protein, max_offset=20): 
+    """
+    Compares the unedited amino acid at each residue with the protein sequence (an array from protein_to_AAarray), 
+    returns a boolean array of matches, and the offset of the residues from the protein that matches the most
+    """
+    residue, ref_aa = np.asarray(residue, dtype=np.int64), np.asarray(ref_aa, dtype=str)
+    def matches(offset): 
+        pos = residue + offset
+        inside = (pos > 0) & (pos < len(protein))
+        match = np.zeros(len(residue), dtype=bool)
+        match[inside] = protein[pos[inside]] == ref_aa[inside]
+        return match
+    match = matches(0)
+    # LIKELY OFFSET, 0 UNLESS ANOTHER OFFSET MATCHES MORE RESIDUES #
+    counts = {offset:matches(offset).sum() for offset in range(-max_offset, max_offset+1)}
+    best = max(counts, key=lambda offset: (counts[offset], offset == 0))
+    return match, best
+
+def calc_mutation_start(row, col_names, window): 
+    """
+    The amino acid number of the first codon of the codon_window
+    """
+    frame_col, strand_col, gene_pos_col, seq_col, window_start_col, window_end_col = col_names
+    frame, dir, pos = row[frame_col], row[strand_col], row[gene_pos_col]
     window1_pos, window2_pos = row[window_start_col], row[window_end_col]
-    dna_window, dna, aa = row[f'{pre}_target_CDS'], row[f'{pre}_codon_window'], row[f'{pre}_residue_window']
-    substitute_pos = int(row[f'{pre}_target_windowpos'])
 
-    # USE POS TO CALCULATE WHICH AMINO ACID #
     if dir == 'sense' and pos != -1:               start = int((pos-frame)/3)+2
     elif dir == 'antisense' and pos != -1:         start = int((pos-frame+1)//3)-2
     elif dir == 'sense' and window1_pos != -1:
@@ -169,32 +352,13 @@ def annotate_muts(row, edit, amino_acid_seq, col_names, pre, window, exons):
         elif window2_pos <= 3:                     start = 0
         else:                                      start = int((window2_pos-(window[1]+1)-frame)/3)+3
     elif dir == 'antisense' and window2_pos != -1: start = int((window2_pos+(window[1]-1)-frame+1)/3)-2
+    return start
 
-    # LIST OF MUTATIONS FOR EACH ROW #
-    mutation_details = []
-    for m in mutation_combos(dna_window, edit, dir): 
-        # COMPARE MUTATED DNA/AA WITH OLD DNA/AA #
-        dna_temp, aa_temp = dna, aa
-        # REPLACE CAUSED AN ISSUE FOR REPEATED AMINO ACIDS AND REGIONS #
-        if dir == 'sense': new_dna = dna[:substitute_pos] + m + dna[substitute_pos+len(dna_window):]
-        else: new_dna = dna[:len(dna)+substitute_pos+1-len(dna_window)] + m + dna[len(dna)+substitute_pos+1:]
-        new_aa = DNA_to_AA(new_dna, upper=False)
-
-        if window_on_boundary(new_dna): 
-            dna_temp = fill_in_dna_exons(dna_temp, row, exons)
-            aa_temp = DNA_to_AA(dna_temp, upper=False)
-            new_dna = fill_in_dna_exons(new_dna, row, exons)
-            new_aa = DNA_to_AA(new_dna, upper=False)
-
-        # FORMAT MUTATIONS AS LETTER-NUMBER-LETTER #
-        if dna_temp != new_dna: 
-            mutations = format_mutation(aa_temp, new_aa, start, amino_acid_seq, dna_temp, new_dna, seq)
-            mutation_details.append(mutations)
-    return ';'.join(set(filter(None, mutation_details)))
-
-def annotate_dual_muts(row, edit, amino_acid_seq, col_names, pre, window, exons): 
+def annotate_muts(row, edit, col_names, window, exons, enumerate_codons=False): 
     """
-    Come up with list of annotations (ie F877L;F877P) for each guide for a dual editor
+    Come up with list of annotations (ie F877L;F877P) for each guide, 
+    edit_from of 2 bases (ie AC to GT) is a dual editor, 
+    row has the target_CDS, target_windowpos, codon_window and residue_window of the guide
     """
     frame_col, strand_col, gene_pos_col, seq_col, window_start_col, window_end_col = col_names
 
@@ -202,48 +366,125 @@ def annotate_dual_muts(row, edit, amino_acid_seq, col_names, pre, window, exons)
         return None
     
     # EXTRACT DATA FROM ROW #
-    frame, dir, pos, seq = row[frame_col], row[strand_col], row[gene_pos_col], row[seq_col]
-    window1_pos, window2_pos = row[window_start_col], row[window_end_col]
-    dna_window, dna, aa = row[f'{pre}_target_CDS'], row[f'{pre}_codon_window'], row[f'{pre}_residue_window']
-    substitute_pos = int(row[f'{pre}_target_windowpos'])
+    dir, seq = row[strand_col], row[seq_col]
+    dna_window, dna, aa = row['target_CDS'], row['codon_window'], row['residue_window']
+    substitute_pos = int(row['target_windowpos'])
 
     # USE POS TO CALCULATE WHICH AMINO ACID #
-    if dir == 'sense' and pos != -1:               start = int((pos-frame)/3)+2
-    elif dir == 'antisense' and pos != -1:         start = int((pos-frame+1)//3)-2
-    elif dir == 'sense' and window1_pos != -1:
-        if window1_pos < 3:                        start = 1
-        else:                                      start = int((window1_pos-(window[0]+1)-frame)/3)+3
-    elif dir == 'antisense' and window1_pos != -1: start = int((window1_pos+(window[0]-1)-frame+1)/3)-2
-    elif dir == 'sense' and window2_pos != -1: 
-        if window2_pos == 0:                       start = -1
-        elif window2_pos <= 3:                     start = 0
-        else:                                      start = int((window2_pos-(window[1]+1)-frame)/3)+3
-    elif dir == 'antisense' and window2_pos != -1: start = int((window2_pos+(window[1]-1)-frame+1)/3)-2
+    start = calc_mutation_start(row, col_names, window)
+
+    # MUTATIONS ONLY DEPEND ON THE LOCAL CONTEXT AND ARE CACHED, #
+    # EXCEPT WHEN THE WINDOW IS ON AN EXON BOUNDARY AND CODONS ARE FILLED IN FROM THE NEIGHBORING EXONS #
+    context = dna_window, dna, aa, substitute_pos, dir, tuple(edit), enumerate_codons
+    if window_on_boundary(insert_window(dna, dna_window, dna_window, substitute_pos, dir)): 
+        mutations = context_mutations(*context, fill=lambda d: fill_in_dna_exons(d, row, exons))
+    else: 
+        mutations = cached_context_mutations(*context)
+    return format_mutations(mutations, start)
+
+def context_mutations(dna_window, dna, aa, substitute_pos, dir, edit, enumerate_codons, fill=None): 
+    """
+    All mutations of a codon_window, each as a tuple of (codon index, amino acid, edited amino acid), 
+    without the residue number of the first codon so it can be reused by other guides
+    """
+    offset = substitute_pos if dir == 'sense' else len(dna)+substitute_pos+1-len(dna_window)
+    # WINDOWS THAT DO NOT FIT INSIDE THE CODONS ARE ENUMERATED AS A WHOLE #
+    if not enumerate_codons or len(dna)%3 != 0 or len(aa) != len(dna)//3 or offset < 0 or offset+len(dna_window) > len(dna): 
+        return window_mutations(dna_window, dna, aa, substitute_pos, dir, edit, fill)
+    return codon_mutations(dna_window, dna, aa, offset, dir, edit, fill)
+
+# BOUNDED CACHE OF context_mutations, SEE mutation_cache_info FOR HITS AND MISSES #
+mutation_cache_size = 2**16
+cached_context_mutations = lru_cache(maxsize=mutation_cache_size)(context_mutations)
+
+def mutation_cache_info(): 
+    """
+    Hits, misses and size of the cache of mutations by local context
+    """
+    return cached_context_mutations.cache_info()
+
+def window_mutations(dna_window, dna, aa, substitute_pos, dir, edit, fill): 
+    """
+    Enumerates every combination of edits in the window
+    """
+    if len(edit[0]) > 1: 
+        edit1, edit2 = (edit[0][0], edit[1][0]), (edit[0][1], edit[1][1])
+        combos = [m2 for m1 in mutation_combos(dna_window, edit1, dir) for m2 in mutation_combos(m1, edit2, dir)]
+    else: combos = mutation_combos(dna_window, edit, dir)
 
-    # LIST OF MUTATIONS FOR EACH ROW #
-    mutation_details = []
-    edit1 = edit[0][0], edit[1][0]
-    edit2 = edit[0][1], edit[1][1]
-    for m1 in mutation_combos(dna_window, edit1, dir): 
-        for m2 in mutation_combos(m1, edit2, dir): 
-            # COMPARE MUTATED DNA/AA WITH OLD DNA/AA #
-            dna_temp, aa_temp = dna, aa
-            # REPLACE CAUSED AN ISSUE FOR REPEATED AMINO ACIDS AND REGIONS #
-            if dir == 'sense': new_dna = dna[:substitute_pos] + m2 + dna[substitute_pos+len(dna_window):]
-            else: new_dna = dna[:len(dna)+substitute_pos+1-len(dna_window)] + m2 + dna[len(dna)+substitute_pos+1:]
+    mutations = set()
+    for m in combos: 
+        # COMPARE MUTATED DNA/AA WITH OLD DNA/AA #
+        dna_temp, aa_temp = dna, aa
+        new_dna = insert_window(dna, dna_window, m, substitute_pos, dir)
+        new_aa = DNA_to_AA(new_dna, upper=False)
+
+        if fill is not None: 
+            dna_temp = fill(dna_temp)
+            aa_temp = DNA_to_AA(dna_temp, upper=False)
+            new_dna = fill(new_dna)
             new_aa = DNA_to_AA(new_dna, upper=False)
 
-            if window_on_boundary(new_dna): 
-                dna_temp = fill_in_dna_exons(dna_temp, row, exons)
-                aa_temp = DNA_to_AA(dna_temp, upper=False)
-                new_dna = fill_in_dna_exons(new_dna, row, exons)
-                new_aa = DNA_to_AA(new_dna, upper=False)
+        if dna_temp != new_dna: 
+            mutations.add(format_mutation(aa_temp, new_aa, dna_temp, new_dna))
+    mutations.discard(())
+    return tuple(sorted(mutations))
+
+def codon_mutations(dna_window, dna, aa, offset, dir, edit, fill): 
+    """
+    A base edit only changes the codon it falls in, so the outcomes of each codon are 
+    looked up separately and then combined, instead of enumerating every edit of the whole window
+    """
+    # ONE (edit_from, edit_to) STEP PER BASE, APPLIED IN ORDER #
+    steps = tuple(zip(edit[0], edit[1]))
+    if dir == 'antisense': steps = tuple((complements[f], complements[t]) for f, t in steps)
+    # UNEDITED DNA WITH THE WINDOW IN PLACE, WHICH CODON POSITIONS ARE IN THE WINDOW #
+    template = dna[:offset] + dna_window + dna[offset+len(dna_window):]
+    in_window = [offset <= i < offset+len(dna_window) for i in range(len(dna))]
+
+    # MUTATIONS OF EACH CODON, () IF THE CODON IS UNCHANGED #
+    codon_muts = []
+    for i in range(len(dna)//3): 
+        old_codon, old_aa = dna[i*3:(i*3)+3], aa[i]
+        if fill is not None: 
+            old_codon = fill(old_codon)
+            old_aa = DNA_to_AA(old_codon, upper=False)
+        muts = set()
+        for new_codon in codon_outcomes(template[i*3:(i*3)+3], tuple(in_window[i*3:(i*3)+3]), steps): 
+            if fill is not None: new_codon = fill(new_codon)
+            if old_codon == new_codon or old_aa == '_': # NO DNA MUT OR INSIDE INTRON
+                muts.add(())
+            else: 
+                muts.add(((i, old_aa, DNA_to_AA(new_codon, upper=False)),))
+        codon_muts.append(muts)
 
-            # FORMAT MUTATIONS AS LETTER-NUMBER-LETTER #
-            if dna_temp != new_dna: 
-                mutations = format_mutation(aa_temp, new_aa, start, amino_acid_seq, dna_temp, new_dna, seq)
-                mutation_details.append(mutations)
-    return ';'.join(set(filter(None, mutation_details)))
+    # COMBINE THE OUTCOMES OF EACH CODON #
+    mutations = set([sum(combo, ()) for combo in product(*codon_muts)])
+    mutations.discard(())
+    return tuple(sorted(mutations))
+
+@lru_cache(maxsize=None)
+def codon_outcomes(codon, editable, steps): 
+    """
+    All codons that codon can be edited into by steps, only at the editable positions, 
+    the lookup table of one codon for codon_mutations
+    """
+    choices = []
+    for base, e in zip(codon, editable): 
+        bases = base
+        if e: 
+            for edit_from, edit_to in steps: 
+                bases = ''.join(dict.fromkeys(''.join([edit_from+edit_to if b in edit_from else b for b in bases])))
+        choices.append(bases)
+    return tuple(dict.fromkeys([''.join(c) for c in product(*choices)]))
+
+def insert_window(dna, dna_window, m, substitute_pos, dir): 
+    """
+    Replaces the window of dna with m
+    """
+    # REPLACE CAUSED AN ISSUE FOR REPEATED AMINO ACIDS AND REGIONS #
+    if dir == 'sense': return dna[:substitute_pos] + m + dna[substitute_pos+len(dna_window):]
+    return dna[:len(dna)+substitute_pos+1-len(dna_window)] + m + dna[len(dna)+substitute_pos+1:]
 
 def fill_in_dna_exons(new_dna, row, exons): 
     new_dna_codons = [new_dna[i:i + 3] for i in range(0, len(new_dna), 3)]
@@ -292,9 +533,9 @@ def mutation_combos(guide_window, edit, dir):
         mutated.append(''.join(seq))
     return mutated
 
-def format_mutation(aa, new_aa, start, amino_acid_seq, dna, new_dna, guide): 
+def format_mutation(aa, new_aa, dna, new_dna): 
     """
-    Translates and formats the mutation with unedited-position-edited
+    Translates the mutation into (codon index, unedited, edited) for each edited codon
     """
     result = []
     for i in range(len(aa)): 
@@ -302,18 +543,19 @@ def format_mutation(aa, new_aa, start, amino_acid_seq, dna, new_dna, guide):
             continue
         if aa[i] == '_': # INSIDE INTRON
             continue
-        mut = aa[i] + str(start+i) + new_aa[i]
-        assert start+i > 0, f'Error {start}'
-        # CHECK MUT AGAINST PROTEIN SEQ #
-        if amino_acid_seq is not None: 
-            ### assert amino_acid_seq[start+i] == aa[i], f"Error: guide {guide}"
-            if amino_acid_seq[start+i] != aa[i]: 
-                warnings.warn(f"Error: guide {guide}")
-        # ADD EDIT TO LIST #
-        if mut not in result: 
-            result.append(mut)
-    mutation = '/'.join(result)
-    return mutation
+        result.append((i, aa[i], new_aa[i]))
+    return tuple(result)
+
+def format_mutations(mutations, start): 
+    """
+    Formats the mutations with unedited-position-edited, starting from residue start, 
+    the unedited amino acids are checked against the protein sequence by verify_protein_col
+    """
+    for mutation in mutations: 
+        for i, aa, new_aa in mutation: 
+            assert start+i > 0, f'Error {start}'
+    results = set(['/'.join([aa + str(start+i) + new_aa for i, aa, new_aa in mutation]) for mutation in mutations])
+    return ';'.join(sorted(results))
 
 def determine_mutations(row, col_names, pre): 
     """
@@ -0,0 +1,105 @@
+"""
+Author: Calvin XiaoYang Hu
+Date: 240610
+
+{Description: this class is meant to hold the guides of a GeneForCRISPR object as columns, 
+one NumPy array per field and a fixed-width byte array for sequences, so guides can be filtered with boolean masks}
+"""
+
+import numpy as np
+import pandas as pd
+
+from be_scan.sgrna._genomic_ import complement_lut
+# from _genomic_ import complement_lut
+
+# CLASS OBJECT TO STORE GUIDES OF ONE STRAND COLUMN BY COLUMN #
+class GuideTable(): 
+
+    # FIELDS IN THE SAME ORDER AS THE generate_library OUTPUT COLUMNS #
+    fields = ['sgRNA_seq', 'PAM_seq', 'starting_frame', 'gene_pos', 'chr_pos', 'exon', 
+              'windowstart_pos', 'windowend_pos', 'UTR']
+    dtypes = {'starting_frame':np.int8, 'gene_pos':np.int32, 'chr_pos':np.int32, 'exon':np.int16, 
+              'windowstart_pos':np.int32, 'windowend_pos':np.int32, 'UTR':bool}
+
+    # STRAND IS 'sense' OR 'antisense', COLUMNS ARE KEYED BY fields #
+    def __init__(self, strand, columns): 
+        self.strand = strand
+        self.columns = {}
+        for field in self.fields: 
+            if field in self.dtypes: self.columns[field] = np.asarray(columns[field], dtype=self.dtypes[field])
+            else: self.columns[field] = np.asarray(columns[field], dtype=bytes)
+
+    def __len__(self): 
+        return len(self.columns['sgRNA_seq'])
+
+    def __getitem__(self, field): 
+        return self.columns[field]
+
+    # BUILD FROM A LIST OF LISTS WITH ONE ENTRY PER FIELD #
+    @classmethod
+    def from_rows(cls, strand, rows): 
+        cols = list(zip(*rows)) if len(rows) > 0 else [[] for _ in cls.fields]
+        return cls(strand, dict(zip(cls.fields, cols)))
+
+    # STACK TABLES OF THE SAME STRAND #
+    @classmethod
+    def concat(cls, strand, tables): 
+        if len(tables) == 0: 
+            return cls.from_rows(strand, [])
+        return cls(strand, {f: np.concatenate([t[f] for t in tables]) for f in cls.fields})
+
+    # RETURN A NEW TABLE WITH THE ROWS SELECTED BY A BOOLEAN MASK OR INDEX ARRAY #
+    def subset(self, rows): 
+        return GuideTable(self.strand, {f: col[rows] for f, col in self.columns.items()})
+
+    # THE SEQUENCE COLUMN AS A 2D uint8 ARRAY, ONE ROW PER GUIDE #
+    def seq_matrix(self, field='sgRNA_seq'): 
+        seqs = np.ascontiguousarray(self.columns[field])
+        return seqs.view(np.uint8).reshape(len(seqs), seqs.dtype.itemsize)
+
+    def contains(self, sub, start=None, stop=None, upper=False, field='sgRNA_seq'): 
+        """
+        Boolean mask of guides where sub is found in seq[start:stop], 
+        equivalent to (sub in seq[start:stop]) for every guide
+        """
+        mat = self.seq_matrix(field)[:, start:stop]
+        if upper: 
+            mat = np.where((mat >= ord('a')) & (mat <= ord('z')), mat-32, mat)
+        sub = np.frombuffer(sub.encode('ascii'), dtype=np.uint8)
+        found = np.zeros(len(self), dtype=bool)
+        for i in range(mat.shape[1]-len(sub)+1): 
+            found |= (mat[:, i:i+len(sub)] == sub).all(axis=1)
+        return found
+
+    def match_PAM(self, PAM_regex): 
+        """
+        Boolean mask of guides where PAM_regex matches the PAM, 
+        the regex is only run once on each distinct PAM
+        """
+        PAMs, inverse = np.unique(self.columns['PAM_seq'], return_inverse=True)
+        matched = np.array([bool(PAM_regex.match(p.decode('ascii'))) for p in PAMs], dtype=bool)
+        return matched[inverse.reshape(-1)]
+
+    # THE SENSE STRAND SEQUENCE OF EACH GUIDE #
+    def coding_seq(self): 
+        if self.strand == 'sense': 
+            return self.columns['sgRNA_seq']
+        mat = complement_lut[self.seq_matrix()[:, ::-1]]
+        return np.ascontiguousarray(mat).view(self.columns['sgRNA_seq'].dtype).ravel()
+
+    # CONVERT BACK TO A LIST OF LISTS WITH ONE ENTRY PER FIELD #
+    def to_list(self): 
+        cols = [self.columns[f].astype(str) if f not in self.dtypes else self.columns[f] 
+                for f in self.fields]
+        return [list(row) for row in zip(*[col.tolist() for col in cols])]
+
+    # CONVERT TO THE COLUMNS OF THE generate_library OUTPUT #
+    def to_frame(self, gene_strand, gene_name): 
+        df = pd.DataFrame({f: (self.columns[f].astype(str) if f not in self.dtypes 
+                               else self.columns[f].astype(np.int64 if f != 'UTR' else bool)) 
+                           for f in self.fields})
+        df['coding_seq'] = self.coding_seq().astype(str)
+        df['sgRNA_strand'] = self.strand
+        df['gene_strand'] = gene_strand
+        df['gene'] = gene_name
+        return df
@@ -0,0 +1,232 @@
+"""
+Author: Calvin XiaoYang Hu
+Date: 240612
+
+{Description: build-once index of every k-mer of a genome .fasta file on both strands, 
+k-mers are 2-bit encoded into a sorted array that is memory mapped back in, 
+so the occurrences of a list of guides are counted with a binary search instead of a genome pass}
+"""
+
+import os
+import gzip
+import json
+from pathlib import Path
+import numpy as np
+
+# 2-BIT CODE OF EACH BYTE, A C G T ARE 0 1 2 3, EVERYTHING ELSE (N, SOFT MASKED acgt) IS 4 #
+base_codes = np.full(256, 4, dtype=np.uint8)
+for i, b in enumerate('ACGT'): 
+    base_codes[ord(b)] = i
+# PAM OF A K-MER AT THE END OF A RECORD OR WITH A BASE OTHER THAN ACGT #
+no_PAM = np.iinfo(np.uint32).max
+strands = ['fwd', 'rev']
+
+# CLASS OBJECT TO COUNT K-MERS IN A MEMORY MAPPED INDEX WRITTEN BY build_kmer_index #
+class KmerIndex(): 
+
+    # READ THE METADATA AND MEMORY MAP THE SORTED K-MERS AND PAMS OF EACH STRAND #
+    def __init__(self, index_dir): 
+        self.index_dir = Path(index_dir)
+        if not (self.index_dir / 'index.json').exists(): 
+            raise Exception(f'{self.index_dir} is not a k-mer index, create it with build_kmer_index')
+        with open(self.index_dir / 'index.json', 'r') as f: 
+            self.meta = json.load(f)
+        self.k, self.PAM_len = self.meta['k'], self.meta['PAM_len']
+        self.kmers = {s:np.load(self.index_dir / f'{s}_kmers.npy', mmap_mode='r') for s in strands}
+        self.pams = {s:np.load(self.index_dir / f'{s}_pams.npy', mmap_mode='r') for s in strands} if self.PAM_len else {}
+
+    # WHETHER THE INDEX WAS BUILT FROM genome_file AS IT IS NOW #
+    def matches(self, genome_file): 
+        return self.meta['genome'] == file_key(genome_file)
+
+    # WHICH SEQUENCES CAN BE LOOKED UP, THOSE OF LENGTH k WITH ONLY ACGT #
+    def indexable(self, seqs): 
+        return np.array([len(seq) == self.k and not seq.strip('ACGT') for seq in seqs], dtype=bool)
+
+    # [START, END) OF EACH SEQUENCE IN THE SORTED K-MERS OF A STRAND #
+    def ranges(self, seqs, strand='fwd'): 
+        assert self.indexable(seqs).all(), f'only sequences of {self.k} uppercase ACGT bases can be looked up'
+        query = encode_kmers(seqs, self.k)
+        order = np.argsort(query, kind='stable') # SORTED QUERIES READ THE MMAP IN ORDER #
+        starts, ends = np.empty(len(query), dtype=np.int64), np.empty(len(query), dtype=np.int64)
+        starts[order] = np.searchsorted(self.kmers[strand], query[order], side='left')
+        ends[order] = np.searchsorted(self.kmers[strand], query[order], side='right')
+        return starts, ends
+
+    # NUMBER OF OCCURRENCES OF EACH SEQUENCE ON A STRAND OF THE GENOME #
+    def count(self, seqs, strand='fwd'): 
+        starts, ends = self.ranges(seqs, strand)
+        return ends - starts
+
+def file_key(filepath): 
+    """
+    Key of an input file by its path, size and modification time
+    """
+    stat = Path(filepath).stat()
+    return [str(Path(filepath).resolve()), stat.st_size, stat.st_mtime_ns]
+
+def encode_kmers(seqs, k): 
+    """
+    Encodes a list of sequences of k uppercase ACGT bases as 2-bit uint64s, the first base in the highest bits
+    """
+    codes = np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8)
+    codes = base_codes[codes].reshape(-1, k).astype(np.uint64)
+    kmers = np.zeros(len(seqs), dtype=np.uint64)
+    for j in range(k): 
+        kmers = (kmers << np.uint64(2)) | codes[:, j]
+    return kmers
+
+def read_records(genome_file): 
+    """
+    Yields the name and sequence of each record of a genome .fasta (optionally .gz) file
+    """
+    genome_file = str(genome_file)
+    handle = gzip.open(genome_file, 'rt') if genome_file.endswith('.gz') else open(genome_file, 'r')
+    name, lines = '', []
+    with handle: 
+        for line in handle: 
+            if line.startswith('>'): 
+                if lines: 
+                    yield name, ''.join(lines)
+                name, lines = line[1:].split()[0] if line[1:].split() else '', []
+            else: 
+                lines.append(line.rstrip('\r\n'))
+    if lines: 
+        yield name, ''.join(lines)
+
+def record_kmers(codes, k, PAM_len, start, end): 
+    """
+    2-bit k-mers and PAMs of positions start to end of a record of base codes, on both strands, 
+    the PAM of the reverse strand k-mer at a position is the reverse complement of the bases before it, 
+    returns the k-mers and PAMs of each strand without k-mers that contain a base other than ACGT
+    """
+    n = end - start
+    local = codes[start:end+k-1]
+    bad = np.concatenate([[0], np.cumsum(local == 4)])
+    valid = bad[k:k+n] - bad[:n] == 0
+    c = local.astype(np.uint64)
+    fwd, rev = np.zeros(n, dtype=np.uint64), np.zeros(n, dtype=np.uint64)
+    rc = c ^ np.uint64(3) # COMPLEMENT OF A C G T #
+    for j in range(k): 
+        fwd <<= np.uint64(2)
+        fwd |= c[j:j+n]
+        rev <<= np.uint64(2)
+        rev |= rc[k-1-j:k-1-j+n]
+    result = {'fwd':[fwd[valid]], 'rev':[rev[valid]]}
+
+    if PAM_len: 
+        pos = np.arange(start, end)
+        for strand, sign, first in [('fwd', 1, pos+k), ('rev', -1, pos-1)]: 
+            pam = np.zeros(n, dtype=np.uint32)
+            last = first + sign*(PAM_len-1)
+            ok = (np.minimum(first, last) >= 0) & (np.maximum(first, last) < len(codes))
+            for j in range(PAM_len): 
+                idx = np.clip(first + sign*j, 0, len(codes)-1)
+                base = codes[idx].astype(np.uint32)
+                ok &= base != 4
+                base = base if sign == 1 else base ^ np.uint32(3)
+                pam = (pam << np.uint32(2)) | base
+            pam[~ok] = no_PAM
+            result[strand].append(pam[valid])
+    return result
+
+def build_kmer_index(genome_file, index_dir, k=20, PAM_len=0, chunk_size=2**24, n_buckets=256): 
+    """[Summary]
+    Writes an index of every k-mer of a genome .fasta file on both strands to index_dir, 
+    each k-mer is 2-bit encoded into a uint64 and the k-mers of each strand are sorted and saved as .npy files, 
+    optionally with the PAM_len bases that follow each k-mer, so KmerIndex can count guides by binary search.
+    K-mers with a base other than uppercase ACGT are left out, as reference_check does not match them either.
+    The k-mers are split into buckets by their first bases on disk, and each bucket is sorted on its own, 
+    so memory stays around one chunk or one bucket.
+    Nothing is printed, the number of records, bases and k-mers of each strand are kept in index.json (KmerIndex.meta).
+
+    Parameters
+    ------------
+    genome_file: str or path
+        The genome .fasta file, optionally .gz
+    index_dir: str or path
+        The directory of the index
+
+    k: int, default 20
+        Length of the k-mers, at most 32
+    PAM_len: int, default 0
+        Number of bases after each k-mer stored as its PAM, at most 15
+    chunk_size: int, default 2**24
+        Number of positions of a record encoded at a time
+    n_buckets: int, default 256
+        Number of buckets the k-mers are sorted in, a power of 2
+
+    Returns
+    ------------
+    index_dir : path
+        The path of the written index
+    """
+    assert 4 <= k <= 32, 'k must be between 4 and 32'
+    assert 0 <= PAM_len <= 15, 'PAM_len must be between 0 and 15'
+    assert 1 <= n_buckets <= 2**16 and n_buckets & (n_buckets-1) == 0, 'n_buckets must be a power of 2 up to 2**16'
+    index_dir = Path(index_dir)
+    Path.mkdir(index_dir, parents=True, exist_ok=True)
+    # AN EARLIER INDEX OR UNFINISHED BUILD IN index_dir IS REPLACED #
+    for old in list(index_dir.glob('tmp_*')) + [index_dir / 'index.json']: 
+        if old.exists(): 
+            os.remove(old)
+    bucket_bits = int(np.log2(n_buckets))
+    bucket_shift = np.uint64(2*k - bucket_bits)
+    kmer_dtype = np.dtype([('kmer', '<u8'), ('pam', '<u4')]) if PAM_len else np.dtype('<u8')
+    def bucket_path(strand, b): 
+        return index_dir / f'tmp_{strand}_{b}.bin'
+
+    # PASS 1: ENCODE EACH CHUNK OF EACH RECORD, APPEND K-MERS TO THE BUCKET OF THEIR FIRST BASES #
+    sizes = {s:np.zeros(n_buckets, dtype=np.int64) for s in strands}
+    records, bases = 0, 0
+    for name, seq in read_records(genome_file): 
+        records += 1
+        bases += len(seq)
+        codes = base_codes[np.frombuffer(seq.encode('latin-1'), dtype=np.uint8)]
+        for start in range(0, len(codes)-k+1, chunk_size): 
+            result = record_kmers(codes, k, PAM_len, start, min(start+chunk_size, len(codes)-k+1))
+            for strand in strands: 
+                if PAM_len: 
+                    values = np.empty(len(result[strand][0]), dtype=kmer_dtype)
+                    values['kmer'], values['pam'] = result[strand]
+                else: values = result[strand][0]
+                buckets = (result[strand][0] >> bucket_shift).astype(np.uint16)
+                order = np.argsort(buckets, kind='stable') # RADIX SORT OF SMALL INTEGERS #
+                counts = np.bincount(buckets, minlength=n_buckets)
+                sizes[strand] += counts
+                parts = np.split(values[order], np.cumsum(counts)[:-1])
+                for b in np.flatnonzero(counts): 
+                    with open(bucket_path(strand, b), 'ab') as f: 
+                        parts[b].tofile(f)
+
+    # PASS 2: SORT EACH BUCKET BY K-MER THEN PAM INTO ONE MEMORY MAPPED ARRAY PER STRAND #
+    for strand in strands: 
+        total = int(sizes[strand].sum())
+        kmers = np.lib.format.open_memmap(index_dir / f'tmp_{strand}_kmers.npy', mode='w+', dtype=np.uint64, shape=(total, ))
+        pams = np.lib.format.open_memmap(index_dir / f'tmp_{strand}_pams.npy', mode='w+', dtype=np.uint32, shape=(total, )) if PAM_len else None
+        pos = 0
+        for b in range(n_buckets): 
+            if sizes[strand][b] == 0: 
+                continue
+            values = np.fromfile(bucket_path(strand, b), dtype=kmer_dtype)
+            if PAM_len: 
+                values = values[np.lexsort((values['pam'], values['kmer']))]
+                kmers[pos:pos+len(values)], pams[pos:pos+len(values)] = values['kmer'], values['pam']
+            else: kmers[pos:pos+len(values)] = np.sort(values)
+            pos += len(values)
+            os.remove(bucket_path(strand, b))
+        kmers.flush()
+        del kmers
+        os.replace(index_dir / f'tmp_{strand}_kmers.npy', index_dir / f'{strand}_kmers.npy')
+        if PAM_len: 
+            pams.flush()
+            del pams
+            os.replace(index_dir / f'tmp_{strand}_pams.npy', index_dir / f'{strand}_pams.npy')
+
+    # METADATA IS WRITTEN LAST, AN INDEX WITHOUT index.json IS INCOMPLETE #
+    meta = {'genome':file_key(genome_file), 'k':k, 'PAM_len':PAM_len, 'records':records, 'bases':bases, 
+            'kmers':{s:int(sizes[s].sum()) for s in strands}}
+    with open(index_dir / 'index.tmp.json', 'w') as f: 
+        json.dump(meta, f)
+    os.replace(index_dir / 'index.tmp.json', index_dir / 'index.json')
+    return index_dir
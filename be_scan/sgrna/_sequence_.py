@@ -0,0 +1,60 @@
+"""
+Author: Calvin XiaoYang Hu
+Date: 240610
+
+{Description: batch versions of the _genomic_ sequence functions, for lists, arrays or Series of sequences, 
+sequences of the same length are handled as one uint8 array, 
+sequences are not checked here, callers run validate_dna once where sequences enter the package}
+"""
+
+import numpy as np
+import pandas as pd
+
+from be_scan.sgrna._genomic_ import DNA_AA_map, bases, complements, complement_lut, base_to_2bit
+from be_scan.sgrna._genomic_ import _rev_complement, _complement, _DNA_to_AA, seqs_to_matrix
+# from _genomic_ import DNA_AA_map, bases, complements, complement_lut, base_to_2bit
+# from _genomic_ import _rev_complement, _complement, _DNA_to_AA, seqs_to_matrix
+
+# amino acid of each 6 bit codon index (16*first + 4*second + third), plus '_' for untranslatable codons
+codon_AA_lut = np.array([DNA_AA_map[a+b+c] for a in bases for b in bases for c in bases] + ['_'])
+
+# reverse complement of each sequence
+def rev_complement_seqs(seqs): 
+    return _batch(seqs, lambda mat: complement_lut[mat[:, ::-1]], 
+                  lambda seq: _rev_complement(complements, seq))
+
+# complement of each sequence
+def complement_seqs(seqs): 
+    return _batch(seqs, lambda mat: complement_lut[mat], 
+                  lambda seq: _complement(complements, seq))
+
+# amino acid sequence of each sequence, same as DNA_to_AA
+def DNA_to_AA_seqs(seqs, upper=True): 
+    def translate(mat): 
+        assert mat.shape[1] % 3 == 0
+        codons = mat.reshape(len(mat), -1, 3)
+        digits = base_to_2bit[codons].astype(np.int16)
+        aa_index = 16*digits[:, :, 0] + 4*digits[:, :, 1] + digits[:, :, 2]
+        # NON ACGT CODONS, AND LOWERCASE CODONS IF NOT upper, BECOME '_' #
+        untranslatable = (digits == 255).any(axis=2)
+        if not upper: 
+            untranslatable |= (codons >= ord('a')).any(axis=2)
+        aa_index[untranslatable] = 64
+        return np.char.encode(codon_AA_lut[aa_index], 'ascii').view(np.uint8)
+    return _batch(seqs, translate, lambda seq: _DNA_to_AA(seq, upper=upper))
+
+# apply an array function to sequences of the same length, or a string function to each sequence otherwise
+def _batch(seqs, array_func, str_func): 
+    index = seqs.index if isinstance(seqs, pd.Series) else None
+    seqs = np.asarray(seqs, dtype=object)
+    lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int64, count=len(seqs))
+
+    if len(seqs) > 0 and lengths.min() == lengths.max() and lengths[0] > 0 and all(seq.isascii() for seq in seqs): 
+        out = np.ascontiguousarray(array_func(seqs_to_matrix(seqs.astype(str))))
+        result = out.view(f'S{out.shape[1]}').ravel().astype(str).astype(object)
+    else: 
+        result = np.array([str_func(seq) for seq in seqs], dtype=object)
+
+    if index is not None: 
+        return pd.Series(result, index=index)
+    return result
@@ -5,14 +5,18 @@ Date: 231204
 {Description: Annotate window and mutation information about the guide}
 """
 
+import warnings
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from be_scan.sgrna._genomic_ import *
 from be_scan.sgrna._guideRNA_ import *
+from be_scan.sgrna._sequence_ import rev_complement_seqs
 # from _genomic_ import *
 # from _guideRNA_ import *
+# from _sequence_ import rev_complement_seqs
 
 def annotate(
     guides_file, edit_from, edit_to, exons, ### ADD EXONS TO ALL DOCUMENTATION #
@@ -21,7 +25,7 @@ def annotate(
     seq_col = 'sgRNA_seq', frame_col = 'starting_frame', strand_col = 'sgRNA_strand', 
     gene_pos_col='gene_pos', window_start_col='windowstart_pos', window_end_col='windowend_pos', 
     output_name="annotated.csv", output_dir='', exclude_duplicates=True, 
-    return_df=True, save_df=True,
+    return_df=True, save_df=True, enumerate_codons=True, n_jobs=1, mutation_table=False, 
     ): 
     
     """[Summary]
@@ -31,13 +35,16 @@ def annotate(
     ------------
     guides_file: str or path
         The file with the list of guide sequences
-    edit_from: str
-        The base (ACTG) to be replaced, can be a string of multiple bases
-    edit_to: str
-        The base (ACTG) to replace with, can be a string of multiple bases
+    edit_from: str or list of str
+        The base (ACTG) to be replaced, can be a string of multiple bases, 
+        or a list of edit_from to annotate several editors in one pass
+    edit_to: str or list of str
+        The base (ACTG) to replace with, can be a string of multiple bases, 
+        or a list of edit_to, one for each edit_from
 
     protein_filepath: str or path, default ''
-        The file with the protein .fasta sequence for double checking the mutations annotated
+        The file with the protein .fasta sequence for double checking the mutations annotated, 
+        a summary of the check is in df.attrs['protein_check']
     window: tuple or list, default = [4,8]
         Editing window, 4th to 8th bases inclusive by default
 
@@ -65,6 +72,14 @@ def annotate(
         Whether or not to return the resulting dataframe
     save_df : bool, default True
         Whether or not to save the resulting dataframe
+    enumerate_codons : bool, default True
+        Whether to enumerate the edits of each codon separately and combine them, 
+        or every combination of edits in the whole window, both give the same mutations
+    n_jobs : int, default 1
+        Number of worker processes the guides are split across, guides are annotated serially if 1
+    mutation_table : bool, default False
+        Whether or not to also return (and save as mutations_output_name) a long format table 
+        with one row per guide, outcome and residue of the mutations of each editor
 
     Returns
     ------------
@@ -82,6 +97,16 @@ def annotate(
        'mutations'      : str,    a list of mutation (ie F877L, F877P, F877L/F877P)
        'muttypes'       : list,   Missense Nonsense Silent No_C/Exon EssentialSpliceSite Control unique list
        'muttype'        : str,    muttypes condensed down to one type
+       'protein_match'  : bool,   if protein_filepath, whether the unedited amino acids of all mutations match the protein
+    table : pandas dataframe, if mutation_table
+    Dataframe contains
+       'sgRNA_ID'       : str,         the ID code for the guide
+       'editor'         : category,    the editor (ie AtoG)
+       'outcome'        : int32,       index of the ; separated outcome within the guide's mutations
+       'residue'        : int32,       the amino acid position
+       'ref_aa'         : category,    the unedited amino acid
+       'alt_aa'         : category,    the edited amino acid
+       'muttype'        : category,    Missense Nonsense Silent
     """
     path = Path.cwd()
     col_names = frame_col, strand_col, gene_pos_col, seq_col, window_start_col, window_end_col
@@ -94,52 +119,122 @@ def annotate(
     # ASSERTIONS #
     for col in col_names: 
         assert col in df.columns, f"Error {col} not found"
+    validate_dna(df[seq_col], seq_col)
 
-    if len(protein_filepath) > 0: amino_acid_seq = protein_to_AAseq(protein_filepath)
-    else: amino_acid_seq = None
+    if len(protein_filepath) > 0: protein = protein_to_AAarray(protein_filepath)
+    else: protein = None
 
     # sgRNA_ID #
     if 'sgRNA_ID' not in df: 
         df.insert(loc=0, column='sgRNA_ID', value=['sgRNA_'+str(i) for i in range(len(df))])
 
-    edit = edit_from, edit_to
-    pre = edit_from + 'to' + edit_to
+    # ONE (edit_from, edit_to) FOR EACH EDITOR #
+    if isinstance(edit_from, str): edit_from, edit_to = [edit_from], [edit_to]
+    assert len(edit_from) == len(edit_to), "Input one edit_to per edit_from"
+    edits = list(zip(edit_from, edit_to))
+
     # coding_seq, THE CODING SEQUENCE IN THE GENOME BEING EDITED #
     df['coding_seq'] = np.where(df[strand_col]=='sense', df[seq_col], 
-                                df[seq_col].apply(lambda x: rev_complement(complements, x)) )
-    # DELETE ENTRIES WITH THE SAME CODING SEQUENCE #
+                                rev_complement_seqs(df[seq_col]) )
+    # DELETE ENTRIES WITH THE SAME CODING SEQUENCE, WITHIN EACH cas_type IF SEVERAL WERE GENERATED #
     if exclude_duplicates: 
-        dupl_rows = df.duplicated(subset='sgRNA_seq', keep=False)
+        if 'cas_type' in df.columns: 
+            dupl_rows = df.groupby('cas_type', sort=False)['sgRNA_seq'].transform(duplicated_seqs).astype(bool)
+        else: dupl_rows = duplicated_seqs(df['sgRNA_seq'])
         df = df[~dupl_rows]
 
-    # win_overlap #
-    df[f'{pre}_win_overlap'] = df['coding_seq'].apply(lambda x: annotate_intron_exon(x, window))
-    df[f'{pre}_win_overlap'] = df.apply(lambda row: annotate_intron_exon(row['coding_seq'], window) 
-                                        if row[strand_col] == 'sense' 
-                                        else annotate_intron_exon_anti(row['coding_seq'], window), 
-                                        axis=1 )
-    # edit_from+'_count'
-    df[edit_from+'_count'] = df['sgRNA_seq'].apply(lambda x: sum([x[window[0]-1:window[1]].count(e) for e in edit_from]))
-
-    # CALCULATE target_CDS, codon_window, residue_window #
-    df[[f'{pre}_target_CDS', f'{pre}_target_windowpos']] = df.apply(lambda x: calc_coding_window(x, window, col_names), axis=1, result_type='expand') 
-    df[[f'{pre}_codon_window', f'{pre}_residue_window']] = df.apply(lambda x: calc_target(x, window, col_names), axis=1, result_type='expand')
-
-    # PREDICT POSSIBLE MUTATIONS #
-    if len(edit_from) > 1: df[f'{pre}_mutations'] = df.apply(lambda x : annotate_dual_muts(x, edit, amino_acid_seq, col_names, pre, window, exons), axis=1)
-    elif len(edit_from) == 1: df[f'{pre}_mutations'] = df.apply(lambda x : annotate_muts(x, edit, amino_acid_seq, col_names, pre, window, exons), axis=1)
-
-    # CALC muttypes LIST AND SINGLE muttype #
-    df[f'{pre}_muttypes'] = df.apply(lambda x: determine_mutations(x, col_names, pre), axis=1)
-    df[f'{pre}_muttype'] = df.apply(lambda x: categorize_mutations(x, pre, col_names, window, edit_from), axis=1)
-    df[f'{pre}_pos'] = df.apply(
-        lambda row: assign_position(row[f'{pre}_mutations'], row['windowstart_pos'], row['windowend_pos'], row['gene'], row[f'{pre}_muttype']), axis=1 )
-
-    # DROP UNNECESSARY COLUMNS #
-    df = df.drop([f'{pre}_target_CDS', f'{pre}_codon_window', f'{pre}_residue_window', f'{pre}_target_windowpos'], axis=1)
-
-    print(f'Guides annotated for {edit_from} to {edit_to}.')
+    sense = (df[strand_col] == 'sense').to_numpy()
+    coding = ~((df[window_start_col] == -1) & (df[window_end_col] == -1)).to_numpy() # CODING DNA IN WINDOW
+    # win_overlap, THE SAME FOR EVERY EDITOR #
+    win_overlap = win_overlap_col(df['coding_seq'], sense, window)
+
+    # CALCULATE target_CDS, codon_window, residue_window ONCE FOR ALL EDITORS #
+    guides = df[[col for col in df.columns if col not in ['coding_seq']]].copy()
+    guides['target_CDS'], guides['target_windowpos'] = calc_coding_window_cols(df[seq_col], sense, df[frame_col], coding, window)
+    guides['codon_window'], guides['residue_window'] = calc_target_cols(df[seq_col], sense, df[frame_col], coding, window)
+
+    # PREDICT POSSIBLE MUTATIONS, muttypes LIST AND SINGLE muttype, ONE GUIDE AT A TIME #
+    params = edits, col_names, window, enumerate_codons
+    if n_jobs == 1: 
+        results = [_annotate_guides(guides, params, exons)]
+    else: 
+        # CHUNKS STAY IN INPUT ORDER, exons ARE SENT ONCE TO EACH WORKER #
+        chunk_size = max(1, -(-len(guides)//(n_jobs*4)))
+        chunks = [guides.iloc[i:i+chunk_size] for i in range(0, len(guides), chunk_size)]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, 
+                                 initargs=(exons, )) as executor: 
+            results = list(executor.map(_annotate_worker, chunks, [params]*len(chunks)))
+    print(f'Mutations of {sum([r[-2] for r in results])} guides reused from the cache, {sum([r[-1] for r in results])} computed')
+
+    # ADD THE COLUMNS OF EACH EDITOR #
+    for e, (ef, et) in enumerate(edits): 
+        pre = ef + 'to' + et
+        df[f'{pre}_win_overlap'] = win_overlap
+        df[ef+'_count'] = edit_count_col(df['sgRNA_seq'], ef, window)
+        for i, col in enumerate(['mutations', 'muttypes', 'muttype', 'pos']): 
+            df[f'{pre}_{col}'] = [x for r in results for x in r[e][i]]
+        print(f'Guides annotated for {ef} to {et}.')
+
+    # ONE ROW PER GUIDE, OUTCOME AND RESIDUE #
+    if mutation_table or protein is not None: 
+        table = pd.concat([mutation_table_col(df[f'{ef}to{et}_mutations'], f'{ef}to{et}') for ef, et in edits], ignore_index=True)
+        table['editor'] = table['editor'].astype('category')
+        table.insert(loc=0, column='sgRNA_ID', value=df['sgRNA_ID'].to_numpy()[table['guide'].to_numpy()])
+
+    # CHECK THE UNEDITED AMINO ACIDS OF ALL MUTATIONS AGAINST THE PROTEIN SEQ AT ONCE #
+    if protein is not None: 
+        match, offset = verify_protein_col(table['residue'], table['ref_aa'], protein)
+        mismatched = table['guide'].to_numpy()[~match]
+        df['protein_match'] = ~np.isin(np.arange(len(df)), mismatched)
+        report = {'residues_checked':len(match), 'mismatches':int((~match).sum()), 
+                  'mismatched_guides':len(np.unique(mismatched)), 
+                  'first_mismatched_guides':pd.unique(table['sgRNA_ID'].to_numpy()[~match])[:10].tolist(), 
+                  'likely_offset':offset, }
+        df.attrs['protein_check'] = report
+        print(f"{report['mismatches']} of {report['residues_checked']} mutated residues do not match {protein_filepath}")
+        if report['mismatches'] > 0: 
+            warnings.warn(f"{report['mismatched_guides']} guides do not match the protein sequence, "
+                          f"first guides: {report['first_mismatched_guides']}, likely offset: {offset}")
+    if mutation_table: 
+        table = table.drop('guide', axis=1)
+
     if save_df: 
         Path.mkdir(path / output_dir, exist_ok=True)
         df.to_csv(path / output_dir / output_name, index=False)
+        if mutation_table: 
+            table.to_csv(path / output_dir / f'mutations_{output_name}', index=False)
+    if return_df and mutation_table: return df, table
     if return_df: return df
+
+def _annotate_guides(guides, params, exons): 
+    """
+    Annotates the mutations, muttypes, muttype and position of a dataframe of guides for each editor, 
+    returns the columns of each editor as lists and the mutation cache hits and misses
+    """
+    edits, col_names, window, enumerate_codons = params
+    frame_col, strand_col, gene_pos_col, seq_col, window_start_col, window_end_col = col_names
+    rows = guides.to_dict('records')
+    sense = (guides[strand_col] == 'sense').to_numpy()
+    coding = ~((guides[window_start_col] == -1) & (guides[window_end_col] == -1)).to_numpy() # CODING DNA IN WINDOW
+    utr = guides['UTR'] if 'UTR' in guides.columns else [False]*len(guides)
+    cache_before = mutation_cache_info()
+    results = []
+    for edit in edits: 
+        pre = edit[0] + 'to' + edit[1]
+        mutations = [annotate_muts(row, edit, col_names, window, exons, enumerate_codons) for row in rows]
+        muttypes = determine_mutations_col(mutations, coding).tolist()
+        muttype = categorize_mutations_col(guides['sgRNA_seq'], sense, muttypes, utr, edit[0], window).tolist()
+        pos = [assign_position(mutation, row['windowstart_pos'], row['windowend_pos'], row['gene'], m) 
+               for row, mutation, m in zip(rows, mutations, muttype)]
+        results.append((mutations, muttypes, muttype, pos))
+    cache_after = mutation_cache_info()
+    return results + [cache_after.hits-cache_before.hits, cache_after.misses-cache_before.misses]
+
+# exons OF EACH WORKER PROCESS, SET ONCE BY _init_worker #
+_worker_data = {}
+
+def _init_worker(exons): 
+    _worker_data['exons'] = exons
+
+def _annotate_worker(guides, params): 
+    return _annotate_guides(guides, params, _worker_data['exons'])
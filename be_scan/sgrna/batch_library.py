@@ -0,0 +1,152 @@
+"""
+Author: Calvin XiaoYang Hu
+Date: 240610
+
+{Description: Generate and annotate libraries for many genes at once across a pool of processes}
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import pandas as pd
+
+from be_scan.sgrna.generate_library import generate_library
+from be_scan.sgrna.annotate import annotate
+# from generate_library import generate_library
+# from annotate import annotate
+
+def batch_library(
+    gene_filepaths, 
+    cas_type='SpG', 
+
+    edit_from_list=['A', 'C', 'AC'], edit_to_list=['G', 'T', 'GT'], 
+    gene_names=None, protein_filepaths=None, 
+    PAM=None, window=[4,8], n_jobs=1, 
+    exclude_introns=False, exclude_nonediting=False, exclude_duplicates=True, exclude_sequences=['TTTT'], 
+
+    output_name='batch_guides.csv', stats_name='batch_stats.csv', output_dir='', 
+    return_df=True, save_df=True, 
+    ): 
+
+    """[Summary]
+    Generates and annotates a library for each gene .fasta file, 
+    with each gene processed in its own worker process, 
+    and concatenates the results in the input order.
+
+    Parameters
+    ------------
+    gene_filepaths: list of str or path, or str or path
+        The files with the gene sequences, or a directory of .fasta/.fa files
+    cas_type: str
+        A type of predetermined Cas (ie Sp, SpG, SpRY, etc)
+        This variable is superceded by PAM
+
+    edit_from_list: list of str
+        The bases (ACTG) to be replaced
+    edit_to_list: list of str
+        The bases (ACTG) to replace with
+    gene_names: list of str, default None
+        The name of each gene, defaults to the file names without the extension
+    protein_filepaths: list of str or path, default None
+        The protein .fasta file of each gene for double checking the mutations annotated
+    PAM: str, default None
+        Optional field to input a custom PAM or a known PAM
+        This field supercedes cas_type
+    window: tuple or list, default = [4,8]
+        Editing window, 4th to 8th bases inclusive by default
+    n_jobs: int, default 1
+        Number of worker processes, genes are processed serially if 1
+
+    exclude_introns : bool, default True
+        Whether or not the editible base needs to be in an intron
+    exclude_nonediting : bool, default True
+        Whether or not the editible base needs to be in the window
+    exclude_duplicates : bool, default True
+        Whether or not duplicate guides should be removed from the pool
+    exclude_sequences : list of strings, defailt ['TTTT']
+        Exclude guides with sequences in this list
+
+    output_name : str or path, default 'batch_guides.csv'
+        Name of the output .csv guides file
+    stats_name : str or path, default 'batch_stats.csv'
+        Name of the output .csv per gene statistics file
+    output_dir : str or path, default ''
+        Directory path of the output .csv files
+    return_df : bool, default True
+        Whether or not to return the resulting dataframes
+    save_df : bool, default True
+        Whether or not to save the resulting dataframes
+
+    Returns
+    ------------
+    df : pandas dataframe
+        The annotated guides of all genes, with an sgRNA_ID of gene_sgRNA_i
+    stats : pandas dataframe
+        Contains 'gene', 'gene_filepath', 'guide_count', 
+        'generate_seconds', 'annotate_seconds', 'total_seconds' for each gene
+    """
+    path = Path.cwd()
+
+    # PREPROCESS INPUT FILES #
+    if isinstance(gene_filepaths, (str, Path)): 
+        gene_dir = Path(gene_filepaths)
+        gene_filepaths = sorted(list(gene_dir.glob('*.fasta')) + list(gene_dir.glob('*.fa')))
+    assert len(gene_filepaths) > 0, "No gene files found"
+    if gene_names is None: 
+        gene_names = [Path(f).stem for f in gene_filepaths]
+    if protein_filepaths is None: 
+        protein_filepaths = ['']*len(gene_filepaths)
+    assert len(gene_names) == len(gene_filepaths), "Input one gene name per gene file"
+    assert len(protein_filepaths) == len(gene_filepaths), "Input one protein file per gene file"
+    assert len(set(gene_names)) == len(gene_names), "Gene names must be unique"
+
+    params = {'cas_type':cas_type, 'edit_from_list':edit_from_list, 'edit_to_list':edit_to_list, 
+              'PAM':PAM, 'window':window, 
+              'exclude_introns':exclude_introns, 'exclude_nonediting':exclude_nonediting, 
+              'exclude_duplicates':exclude_duplicates, 'exclude_sequences':exclude_sequences, }
+    jobs = [dict(params, gene_filepath=str(f), gene_name=name, protein_filepath=str(prot))
+            for f, name, prot in zip(gene_filepaths, gene_names, protein_filepaths)]
+
+    # RUN EACH GENE, RESULTS STAY IN INPUT ORDER #
+    if n_jobs == 1: 
+        results = [_library_for_gene(job) for job in jobs]
+    else: 
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor: 
+            results = list(executor.map(_library_for_gene, jobs))
+
+    df = pd.concat([r[0] for r in results], ignore_index=True)
+    stats = pd.DataFrame([r[1] for r in results])
+    print('Complete!', df.shape[0], 'guides generated from', len(jobs), 'genes')
+
+    if save_df: 
+        Path.mkdir(path / output_dir, exist_ok=True)
+        df.to_csv(path / output_dir / output_name, index=False)
+        stats.to_csv(path / output_dir / stats_name, index=False)
+    if return_df: 
+        return df, stats
+
+def _library_for_gene(job): 
+    """
+    Generates and annotates the library of one gene, returns the guides and timing stats
+    """
+    start = time.perf_counter()
+    guides, gene = generate_library(
+        gene_filepath=job['gene_filepath'], gene_name=job['gene_name'], 
+        cas_type=job['cas_type'], edit_from=job['edit_from_list'][0], edit_to=job['edit_to_list'][0], 
+        PAM=job['PAM'], window=job['window'], return_df=True, save_df=False, 
+        exclude_introns=job['exclude_introns'], exclude_nonediting=job['exclude_nonediting'], 
+        exclude_duplicates=job['exclude_duplicates'], exclude_sequences=job['exclude_sequences'], )
+    generated = time.perf_counter()
+
+    # sgRNA_ID IS PREFIXED BY GENE SO IDS ARE UNIQUE AFTER CONCATENATING #
+    guides.insert(loc=0, column='sgRNA_ID', value=[f"{job['gene_name']}_sgRNA_{i}" for i in range(len(guides))])
+    guides = annotate(
+        guides_file=guides, edit_from=job['edit_from_list'], edit_to=job['edit_to_list'], exons=gene.exons, 
+        protein_filepath=job['protein_filepath'], window=job['window'], 
+        exclude_duplicates=job['exclude_duplicates'], return_df=True, save_df=False, )
+    annotated = time.perf_counter()
+
+    stats = {'gene':job['gene_name'], 'gene_filepath':job['gene_filepath'], 'guide_count':guides.shape[0], 
+             'generate_seconds':generated-start, 'annotate_seconds':annotated-generated, 
+             'total_seconds':annotated-start, }
+    return guides, stats
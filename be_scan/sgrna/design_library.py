@@ -5,7 +5,12 @@ Date: 231204
 {Description: Annotate window and mutation information about the guide}
 """
 import os
+import time
+import json
+import hashlib
+import tracemalloc
 from pathlib import Path
+import pandas as pd
 
 from be_scan.sgrna.generate_library import generate_library
 from be_scan.sgrna.reference_check import reference_check
@@ -22,11 +27,11 @@ def design_library(
 
     edit_from_list=['A', 'C', 'AC'], edit_to_list=['G', 'T', 'GT'], 
     genome_file='', protein_filepath='', delete=False, 
-    gene_name='', PAM=None, window=[4,8], 
+    gene_name='', PAM=None, window=[4,8], cache_dir=None, 
     exclude_introns=False, exclude_nonediting=False, exclude_duplicates=True, exclude_sequences=['TTTT'], 
 
-    output_name='annotated_guides.csv', output_dir='', 
-    return_df=True, save_df=True,
+    output_name='annotated_guides.csv', output_dir='', checkpoint_dir=None, 
+    return_df=True, save_df=True, return_report=False, 
     ): 
     
     """[Summary]
@@ -60,6 +65,8 @@ def design_library(
         This field supercedes cas_type
     window: tuple or list, default = [4,8]
         Editing window, 4th to 8th bases inclusive by default
+    cache_dir: str or path, default None
+        Optional directory to cache the parsed gene and its guides in, see generate_library
 
     exclude_introns : bool, default True
         Whether or not the editible base needs to be in an intron
@@ -74,10 +81,15 @@ def design_library(
         Name of the output .csv guides file
     output_dir : str or path, default ''
         Directory path of the output .cs guides file
+    checkpoint_dir : str or path, default None
+        Optional directory to save the result of each stage in, 
+        a rerun with the same parameters resumes from the last saved stage
     return_df : bool, default True
         Whether or not to return the resulting dataframe
     save_df : bool, default True
         Whether or not to save the resulting dataframe
+    return_report : bool, default False
+        Whether or not to also return the time and peak memory of each stage
 
     Returns
     ------------
@@ -105,53 +117,121 @@ def design_library(
        'muttypes'       : list,   Missense Nonsense Silent No_C/Exon EssentialSpliceSite Control unique list
        'muttype'        : str,    muttypes condensed down to one type
        'genome_occurrences' : int, how many times this sequence occurs in the referecnce genome
+    report : pandas dataframe, if return_report
+    Dataframe contains 'stage', 'seconds', 'peak_memory_MB', 'rows', 'checkpoint' for each stage
     """
-    temp = "temp.csv"
+    # EACH STAGE PASSES ITS DATAFRAME TO THE NEXT IN MEMORY #
+    report = []
+    def run(stage, func, params, key): 
+        return _run_stage(stage, func, params, key, checkpoint_dir, report, track_memory=return_report)
 
     # GENERATE LIBRARY #
     generate_library_params = {
         'gene_filepath':gene_filepath, 'gene_name':gene_name, 
         'cas_type':cas_type, 'edit_from':edit_from_list[0], 'edit_to':edit_to_list[0], 
-        'PAM':PAM, 'window':window, 'return_df':True, 'save_df':False, 
+        'PAM':PAM, 'window':window, 'cache_dir':cache_dir, 'return_df':True, 'save_df':False, 
         'exclude_introns':exclude_introns, 'exclude_nonediting':exclude_nonediting, 
         'exclude_duplicates':exclude_duplicates, 'exclude_sequences':exclude_sequences, }
-    guides, gene = generate_library(**generate_library_params)
-    guides.to_csv(temp, index=False)
-
-    # ANNOTATE LIBRARY FOR ALL THREE TYPES #
-    for edit_from, edit_to in zip(edit_from_list, edit_to_list): 
-        annotate_params = {
-            'guides_file':temp, 'edit_from':edit_from, 'edit_to':edit_to,
-            'exons':gene.exons, 
-            'protein_filepath':protein_filepath, 'window':window, 
-            'exclude_duplicates':exclude_duplicates, 'return_df':True, 'save_df':False, }
-        annotated = annotate(**annotate_params)
-        annotated.to_csv(temp, index=False)
+    key = _stage_key('', generate_library_params)
+    guides, gene = run('generate_library', generate_library, generate_library_params, key)
+
+    # ANNOTATE LIBRARY FOR ALL TYPES IN ONE PASS #
+    annotate_params = {
+        'guides_file':guides, 'edit_from':edit_from_list, 'edit_to':edit_to_list,
+        'exons':gene.exons, 
+        'protein_filepath':protein_filepath, 'window':window, 
+        'exclude_duplicates':exclude_duplicates, 'return_df':True, 'save_df':False, }
+    key = _stage_key(key, annotate_params)
+    annotated = run('annotate', annotate, annotate_params, key)
     
-    # ORGANIZE BY AMINO ACID AND CHECK COVERAGE FOR ALL THREE TYPES #
+    # ORGANIZE BY AMINO ACID AND CHECK COVERAGE FOR ALL TYPES #
     if len(protein_filepath) > 0: 
-        for edit_from, edit_to in zip(edit_from_list, edit_to_list): 
-            coverage_params = {
-                'annotated_guides':temp, 'edit_from':edit_from, 'edit_to':edit_to, 
-                'protein_filepath':protein_filepath, 'output_dir':output_dir, 
-                'return_df':True, 'save_df':True, }
-            annotated_by_aa, plots = coverage_plots(**coverage_params)
+        def coverage_all(annotated_guides, output_dir): 
+            for edit_from, edit_to in zip(edit_from_list, edit_to_list): 
+                coverage_params = {
+                    'annotated_guides':annotated_guides, 'edit_from':edit_from, 'edit_to':edit_to, 
+                    'protein_filepath':protein_filepath, 'output_dir':output_dir, 
+                    'return_df':True, 'save_df':True, }
+                annotated_by_aa, plots = coverage_plots(**coverage_params)
+        coverage_all_params = {'annotated_guides':annotated, 'output_dir':output_dir}
+        run('coverage_plots', coverage_all, coverage_all_params, _stage_key(key, coverage_all_params))
 
     # IF GENOME FILE IS PROVIDED, CHECK GUIDES AGAINST THIS REFERENCE SEQUENCE
     if len(genome_file) > 0: 
         ref_check_params = {
-            'guides_file':temp, 'genome_file':genome_file, 
+            'guides_file':annotated, 'genome_file':genome_file, 
             'delete':delete, 'return_df':True, 'save_df':False, }
-        annotated = reference_check(**ref_check_params)
+        key = _stage_key(key, ref_check_params)
+        annotated = run('reference_check', reference_check, ref_check_params, key)
 
-    os.remove(temp)
     print('Complete! Library generated from', str(gene_filepath))
+    report = pd.DataFrame(report)
 
     if save_df: 
         out_filepath = Path(output_dir)
         annotated.to_csv(out_filepath / output_name, index=False)
+    if return_df and return_report: 
+        return annotated, report
     if return_df: 
         return annotated
+    if return_report: 
+        return report
+
+def _stage_key(prev_key, params): 
+    """
+    Key of a stage from the key of the previous stage and the parameters that are not dataframes, 
+    input files are keyed by their size and modification time
+    """
+    values = {}
+    for k, v in params.items(): 
+        if isinstance(v, pd.DataFrame): 
+            continue
+        if hasattr(v, 'filepath'): # GeneForCRISPR
+            v = v.filepath
+        if isinstance(v, (str, Path)) and len(str(v)) > 0 and Path(v).is_file(): 
+            stat = Path(v).stat()
+            v = [str(v), stat.st_size, stat.st_mtime_ns]
+        values[k] = v
+    params = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256((prev_key + params).encode('utf-8')).hexdigest()
+
+def _run_stage(stage, func, params, key, checkpoint_dir, report, track_memory): 
+    """
+    Runs one stage, or loads its result from a checkpoint with the same key, 
+    then saves the checkpoint and adds the time and peak memory of the stage to report
+    """
+    start = time.perf_counter()
+    if track_memory: 
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing: tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    checkpoint = Path(checkpoint_dir) / f'{stage}.pkl' if checkpoint_dir is not None else None
+    status = 'none'
+    if checkpoint is not None and checkpoint.exists(): 
+        saved = pd.read_pickle(checkpoint)
+        if saved['key'] == key: 
+            result, status = saved['result'], 'loaded'
+    if status != 'loaded': 
+        result = func(**params)
+        if checkpoint is not None: 
+            # WRITE TO A TEMPORARY FILE FIRST SO A CHECKPOINT IS NEVER HALF WRITTEN #
+            Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+            temp = checkpoint.with_suffix('.tmp')
+            pd.to_pickle({'key':key, 'result':result}, temp)
+            os.replace(temp, checkpoint)
+            status = 'saved'
+
+    peak = 0
+    if track_memory: 
+        peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing: tracemalloc.stop()
+    seconds = time.perf_counter() - start
+    df = result[0] if isinstance(result, tuple) else result
+    report.append({'stage':stage, 'seconds':seconds, 'peak_memory_MB':peak/2**20, 
+                   'rows':len(df) if isinstance(df, pd.DataFrame) else None, 'checkpoint':status, })
+    print(stage, 'finished in', round(seconds, 2), 's', '(from checkpoint)' if status == 'loaded' else '')
+    return result
     
 # design_library(
 #     gene_filepath='tests/test_data/sgrna/230408_AR_Input.fasta', 
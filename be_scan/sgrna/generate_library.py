@@ -10,17 +10,17 @@ import pandas as pd
 import warnings
 
 from be_scan.sgrna._genomic_ import *
-from be_scan.sgrna._guideRNA_ import filter_guide, filter_sequence
+from be_scan.sgrna._guideRNA_ import filter_edit
 from be_scan.sgrna._gene_ import GeneForCRISPR
 # from _genomic_ import *
-# from _guideRNA_ import filter_guide, filter_sequence
+# from _guideRNA_ import filter_edit
 # from _gene_ import GeneForCRISPR
 
 def generate_library(
     gene_filepath, 
     cas_type, edit_from, edit_to, 
 
-    gene_name='', PAM=None, window=[4,8], 
+    gene_name='', PAM=None, window=[4,8], cache_dir=None, 
     output_name='guides.csv', output_dir='', return_df=True, save_df=True, 
     exclude_introns=False, exclude_nonediting=False, exclude_duplicates=True, exclude_sequences=['TTTT']
     ): 
@@ -33,10 +33,12 @@ def generate_library(
     Parameters
     ------------
     gene_filepath: str or path
-        The file with the gene .fasta sequence
-    cas_type: str
+        The file with the gene .fasta sequence, 
+        or a GeneForCRISPR object ie from GeneForCRISPR.from_genome
+    cas_type: str or list of str
         A type of predetermined Cas (ie Sp, SpG, SpRY, etc)
         This variable is superceded by PAM
+        If a list, the gene is enumerated once and a library is made for each Cas
     edit_from: char
         The base (ACTG) to be replaced
     edit_to: char
@@ -44,11 +46,16 @@ def generate_library(
 
     gene_name: str, default ''
         The name of the gene, can be any string
-    PAM: str, default None
+    PAM: str or list of str, default None
         Optional field to input a custom PAM or a known PAM
         This field supercedes cas_type
+        If a list, a library is made for each PAM, paired with cas_type if it is also a list
+        A single PAM supercedes every cas_type, so it cannot be input with a list of cas_type
     window: tuple or list, default = [4,8]
         Editing window, 4th to 8th bases inclusive by default
+    cache_dir: str or path, default None
+        Optional directory to cache the parsed gene and its guides in, 
+        keyed by the gene file content, window and PAM, so later runs skip parsing and enumeration
 
     output_name : str or path, default 'guides.csv'
         Name of the output .csv guides file
@@ -82,8 +89,114 @@ def generate_library(
        'sgRNA_strand'   : str,    (ie sense or antisense)
        'gene_strand'    : str,    (ie plus or minus)
        'gene'           : str,    name of the gene
+       'cas_type'       : str,    only if several cas_type or PAM are input, the cas_type or the PAM if input, 
+                                  duplicates are removed within each cas_type
     """
 
+    # SEVERAL cas_type OR PAM ARE RUN TOGETHER ON ONE ENUMERATION OF THE GENE #
+    cas_list = preprocess_cas_list(cas_type, edit_from, edit_to, PAM, window)
+    enumerate_PAM = cas_list['enumerate_PAM']
+    
+    path = Path.cwd()
+    # CREATE GENE OBJECT #
+    if isinstance(gene_filepath, GeneForCRISPR): gene = gene_filepath
+    else: gene = GeneForCRISPR(filepath=gene_filepath)
+    print('Create gene object from', gene.filepath)
+    # LOAD PARSED GENE AND GUIDES FROM CACHE, OR PARSE AND CACHE THEM #
+    if cache_dir is not None and gene.load_cache(cache_dir, window=window, PAM=enumerate_PAM): 
+        print('Loaded', len(gene.exons), 'exons and guides from cache')
+    else: 
+        gene.parse_exons()
+        print('Parsing exons:', len(gene.exons), 'exons found')
+        gene.extract_metadata()
+        # PARSE ALL GUIDES #
+        gene.find_all_guides(window=window, PAM=enumerate_PAM)
+        if cache_dir is not None: 
+            gene.save_cache(cache_dir, window=window, PAM=enumerate_PAM)
+    print('Preprocessing sucessful!')
+    
+    df = filter_library(gene, cas_list, gene_name=gene_name, window=window, 
+                        exclude_introns=exclude_introns, exclude_nonediting=exclude_nonediting, 
+                        exclude_duplicates=exclude_duplicates, exclude_sequences=exclude_sequences)
+
+    print('Guides generated and duplicates removed')
+    print(df.shape[0], 'guides were generated')
+    # SAVE AND OUTPUT #
+    if save_df: 
+        Path.mkdir(path / output_dir, exist_ok=True)
+        df.to_csv(path / output_dir / output_name, index=False)
+    if return_df: 
+        return df, gene
+
+def filter_library(
+    gene, cas_list, 
+    gene_name='', window=[4,8], 
+    exclude_introns=False, exclude_nonediting=False, exclude_duplicates=True, exclude_sequences=['TTTT'], 
+    ): 
+    """
+    Filters the enumerated guides of a gene for each cas_type of cas_list (from preprocess_cas_list), 
+    returns the guides as a dataframe
+    """
+    # FILTER LIBRARY ACCORDING TO SPECIFICATIONS FOR NONEDITING, INTRONIC #
+    filter_edit_input = {'edit':cas_list['edit'], 'window':window, 
+                         'excl_introns':exclude_introns, 'excl_nonediting':exclude_nonediting}
+    fwd_keep = filter_edit(gene.fwd_guides, **filter_edit_input)
+    rev_keep = filter_edit(gene.rev_guides, **filter_edit_input)
+    # FILTER OUT UNWANTED SEQUENCES #
+    for sequence in exclude_sequences: 
+        fwd_keep &= ~gene.fwd_guides.contains(sequence, upper=True)
+        rev_keep &= ~gene.rev_guides.contains(sequence, upper=True)
+
+    dfs = []
+    for label, (_, PAM, PAM_regex) in zip(cas_list['labels'], cas_list['inputs']): 
+        # FILTER LIBRARY ACCORDING TO PAM #
+        fwd_results = gene.fwd_guides.subset(fwd_keep & gene.fwd_guides.match_PAM(PAM_regex))
+        rev_results = gene.rev_guides.subset(rev_keep & gene.rev_guides.match_PAM(PAM_regex))
+
+        # ADD EXTRA ANNOTATIONS AND COMBINE #
+        df = pd.concat([fwd_results.to_frame(gene.strand, gene_name), 
+                        rev_results.to_frame(gene.strand, gene_name)], ignore_index=True)
+
+        # DELETE DUPLICATES BETWEEN FWD, BETWEEN REV, BETWEEN FWD AND REV #
+        if exclude_duplicates: 
+            dupl_rows = duplicated_seqs(df['sgRNA_seq'])
+            df = df[~dupl_rows]
+        if cas_list['multi']: 
+            df['cas_type'] = label
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True) if cas_list['multi'] else dfs[0]
+
+def preprocess_cas_list(cas_type, edit_from, edit_to, PAM, window): 
+    """
+    Pairs up a cas_type or list of cas_type with a PAM or list of PAM and checks each with preprocess_inputs, 
+    returns a dict of the cas_types, PAMs, inputs, edit, multi (whether lists were input), 
+    labels (the cas_type column, the cas_type or the PAM if input), 
+    and the PAM to enumerate guides from (None if there are several PAMs)
+    """
+    multi = isinstance(cas_type, (list, tuple)) or isinstance(PAM, (list, tuple))
+    # A SINGLE PAM SUPERCEDES EVERY cas_type, WHICH WOULD GIVE THE SAME LIBRARY FOR EACH cas_type #
+    if isinstance(cas_type, (list, tuple)) and len(cas_type) > 1 and PAM is not None and not isinstance(PAM, (list, tuple)): 
+        raise Exception('A single PAM supercedes every cas_type, input one PAM per cas_type or a single cas_type')
+    cas_types = list(cas_type) if isinstance(cas_type, (list, tuple)) else [cas_type]
+    PAMs = list(PAM) if isinstance(PAM, (list, tuple)) else [PAM]
+    if len(cas_types) == 1: 
+        cas_types = cas_types*len(PAMs)
+    if len(PAMs) == 1: 
+        PAMs = PAMs*len(cas_types)
+    assert len(cas_types) == len(PAMs), "Input one PAM per cas_type"
+    assert len(cas_types) > 0, "Input at least one cas_type"
+    labels = [c if p is None else p for c, p in zip(cas_types, PAMs)]
+    assert len(set(labels)) == len(labels), f"Each library needs a different cas_type or PAM, {labels} were input"
+    inputs = [preprocess_inputs(c, edit_from, edit_to, p, window) for c, p in zip(cas_types, PAMs)]
+    # ENUMERATE FROM PAM SITES IF THERE IS ONE PAM, OTHERWISE ALL GUIDES #
+    enumerate_PAM = inputs[0][1] if len(set([PAM for _, PAM, _ in inputs])) == 1 else None
+    return {'cas_types':cas_types, 'PAMs':PAMs, 'labels':labels, 'inputs':inputs, 'edit':inputs[0][0], 
+            'multi':multi, 'enumerate_PAM':enumerate_PAM}
+
+def preprocess_inputs(cas_type, edit_from, edit_to, PAM, window): 
+    """
+    Checks the cas_type, edit and window inputs, returns the edit, PAM and PAM regex
+    """
     # PREPROCESS cas_type #
     if cas_type not in list(cas_key.keys()): 
         raise Exception('Improper cas type input, the options are '+str(list(cas_key.keys())))
@@ -101,56 +214,4 @@ def generate_library(
     # PREPROCESS WINDOW #
     assert window[1] >= window[0] and window[0] >= 0, "Input a valid window ie [4,8]"
     assert window[1] <= 20, "Input a valid window ie [4,8]"
-    
-    path = Path.cwd()
-    # CREATE GENE OBJECT #
-    gene = GeneForCRISPR(filepath=gene_filepath)
-    print('Create gene object from', gene_filepath)
-    gene.parse_exons()
-    print('Parsing exons:', len(gene.exons), 'exons found')
-    gene.extract_metadata()
-    # PARSE ALL GUIDES #
-    gene.find_all_guides(window=window)
-    print('Preprocessing sucessful!')
-    
-    # SET COLUMN NAMES FOR OUTPUT #
-    column_names = ['sgRNA_seq', 'PAM_seq', 'starting_frame', 'gene_pos', 'chr_pos', 'exon', 
-                    'windowstart_pos', 'windowend_pos', 'UTR', 'coding_seq', 'sgRNA_strand', 
-                    'gene_strand', 'gene', ]
-
-    # FILTER LIBRARY ACCORDING TO SPECIFICATIONS FOR NONEDITING, INTRONIC, PAM #
-    filter_guide_input = {'PAM_regex':PAM_regex, 'edit':edit, 'window':window, 
-                          'excl_introns':exclude_introns, 'excl_nonediting':exclude_nonediting}
-    fwd_results = [g.copy() for g in gene.fwd_guides if filter_guide(g, **filter_guide_input)]
-    rev_results = [g.copy() for g in gene.rev_guides if filter_guide(g, **filter_guide_input)]
-    # FILTER OUT UNWANTED SEQUENCES #
-    for sequence in exclude_sequences: 
-        fwd_results = filter_sequence(fwd_results, sequence)
-        rev_results = filter_sequence(rev_results, sequence)
-
-    # ADD EXTRA ANNOTATIONS AND COMBINE #
-    for x in fwd_results: 
-        x.append(x[0])
-        x.append('sense')
-    for x in rev_results: 
-        x.append(rev_complement(complements, x[0]))
-        x.append('antisense')
-    results = fwd_results + rev_results
-    for x in results: 
-        x.append(gene.strand)
-        x.append(gene_name)
-
-    # DELETE DUPLICATES BETWEEN FWD, BETWEEN REV, BETWEEN FWD AND REV #
-    df = pd.DataFrame(results, columns=column_names)
-    if exclude_duplicates: 
-        dupl_rows = df.duplicated(subset='sgRNA_seq', keep=False)
-        df = df[~dupl_rows]
-
-    print('Guides generated and duplicates removed')
-    print(df.shape[0], 'guides were generated')
-    # SAVE AND OUTPUT #
-    if save_df: 
-        Path.mkdir(path / output_dir, exist_ok=True)
-        df.to_csv(path / output_dir / output_name, index=False)
-    if return_df: 
-        return df, gene
+    return edit, PAM, PAM_regex
@@ -0,0 +1,146 @@
+"""
+Author: Calvin XiaoYang Hu
+Date: 240610
+
+{Description: Generates a library for each transcript of a gene from a .gtf/.gff3 annotation and a genome .fasta, 
+the exons of all transcripts are merged into genomic intervals which are only scanned for PAM sites once, 
+the guides and their annotations are still built for each transcript}
+"""
+
+from pathlib import Path
+import pandas as pd
+
+from be_scan.sgrna._gene_ import GeneForCRISPR
+from be_scan.sgrna._faidx_ import FastaIndex
+from be_scan.sgrna._gtf_ import read_transcripts, merge_intervals
+from be_scan.sgrna._genomic_ import _rev_complement, complements
+from be_scan.sgrna.generate_library import filter_library, preprocess_cas_list
+# from _gene_ import GeneForCRISPR
+# from _faidx_ import FastaIndex
+# from _gtf_ import read_transcripts, merge_intervals
+# from _genomic_ import _rev_complement, complements
+# from generate_library import filter_library, preprocess_cas_list
+
+def isoform_library(
+    annotation_filepath, genome_filepath, gene_name, 
+    cas_type, edit_from, edit_to, 
+
+    transcript_ids=None, fai_filepath=None, pad=20, 
+    PAM=None, window=[4,8], 
+    output_name='isoform_guides.csv', output_dir='', return_df=True, save_df=True, 
+    exclude_introns=False, exclude_nonediting=False, exclude_duplicates=True, exclude_sequences=['TTTT'], 
+    ): 
+
+    """[Summary]
+    Generates the library of generate_library for each transcript of a gene, 
+    with the exons of each transcript read from a .gtf/.gff3 file and fetched from an indexed genome .fasta.
+    The padded exons of all transcripts are merged into genomic intervals, each interval is scanned for PAM sites once, 
+    and the sites are projected onto each transcript's exons by coordinate, 
+    so overlapping exons (ie alternative splice sites) are not scanned for PAM sites again, 
+    only the PAM scan is shared, the guides are built, filtered and annotated for each transcript 
+    with the frame, gene position and exon number of the exon in that transcript.
+
+    Parameters
+    ------------
+    annotation_filepath: str or path
+        The .gtf or .gff3 file (optionally .gz) with the CDS of each transcript
+    genome_filepath: str or path
+        The genome .fasta file, with a .fai index (see build_fai)
+    gene_name: str
+        The gene_name or gene_id of the gene in the annotation file
+    cas_type: str or list of str
+        A type of predetermined Cas (ie Sp, SpG, SpRY, etc)
+        This variable is superceded by PAM
+    edit_from: char
+        The base (ACTG) to be replaced
+    edit_to: char
+        The base (ACTG) to replace with
+
+    transcript_ids: list of str, default None
+        The transcripts to design against, defaults to all coding transcripts of the gene
+    fai_filepath: str or path, default None
+        The .fai index of the genome, defaults to the genome path plus .fai
+    pad: int, default 20
+        Number of intronic bases on each side of each exon
+    PAM: str or list of str, default None
+        Optional field to input a custom PAM or a known PAM
+        This field supercedes cas_type
+    window: tuple or list, default = [4,8]
+        Editing window, 4th to 8th bases inclusive by default
+
+    output_name : str or path, default 'isoform_guides.csv'
+        Name of the output .csv guides file
+    output_dir : str or path, default ''
+        Directory path of the output .csv guides file
+    return_df : bool, default True
+        Whether or not to return the resulting dataframe
+    save_df : bool, default True
+        Whether or not to save the resulting dataframe
+    exclude_introns : bool, default True
+        Whether or not the editible base needs to be in an intron
+    exclude_nonediting : bool, default True
+        Whether or not the editible base needs to be in the window
+    exclude_duplicates : bool, default True
+        Whether or not duplicate guides should be removed from the pool, within each transcript
+    exclude_sequences : list of strings, defailt ['TTTT']
+        Exclude guides with sequences in this list
+
+    Returns
+    ------------
+    df : pandas dataframe
+        The generate_library columns and 'transcript_id' for the guides of every transcript
+    genes : dict of GeneForCRISPR
+        The gene object of each transcript, by transcript_id, ie for annotate with genes[transcript_id].exons
+    """
+    path = Path.cwd()
+    cas_list = preprocess_cas_list(cas_type, edit_from, edit_to, PAM, window)
+    transcripts = read_transcripts(annotation_filepath, gene_name, transcript_ids)
+    print(len(transcripts), 'transcripts of', gene_name, 'found')
+
+    genes, dfs = {}, []
+    with FastaIndex(genome_filepath, fai_filepath) as genome: 
+        for tid, transcript in transcripts.items(): 
+            gene = GeneForCRISPR.from_genome(genome, transcript['exons'], strand=transcript['strand'], 
+                                             gene_name=tid, pad=pad)
+            gene.parse_exons()
+            gene.extract_metadata()
+            genes[tid] = gene
+        # UNIQUE GENOMIC INTERVALS OF THE EXONS OF ALL TRANSCRIPTS, SHARED BETWEEN TRANSCRIPTS #
+        shared = shared_intervals(genes.values(), genome)
+
+    for tid, gene in genes.items(): 
+        gene.find_all_guides(window=window, PAM=cas_list['enumerate_PAM'], shared=shared)
+        df = filter_library(gene, cas_list, gene_name=gene_name, window=window, 
+                            exclude_introns=exclude_introns, exclude_nonediting=exclude_nonediting, 
+                            exclude_duplicates=exclude_duplicates, exclude_sequences=exclude_sequences)
+        df['transcript_id'] = tid
+        dfs.append(df)
+        print(tid, ':', len(gene.exons), 'exons,', df.shape[0], 'guides')
+    df = pd.concat(dfs, ignore_index=True)
+
+    print(len(shared), 'distinct genomic intervals scanned for PAM sites for', sum(len(g.exons) for g in genes.values()), 
+          'exons of', len(transcripts), 'transcripts')
+    print(df.shape[0], 'guides were generated')
+    if save_df: 
+        Path.mkdir(path / output_dir, exist_ok=True)
+        df.to_csv(path / output_dir / output_name, index=False)
+    if return_df: 
+        return df, genes
+
+def shared_intervals(genes, genome): 
+    """
+    Merges the padded exons of several genes built with GeneForCRISPR.from_genome into unique genomic intervals, 
+    returns {(chrom, start, end, strand):{'seq':str}} for the shared argument of GeneForCRISPR.find_all_guides, 
+    with the sequence of each interval in the direction of transcription
+    """
+    windows = {}
+    for gene in genes: 
+        strand = '+' if gene.strand == 'plus' else '-'
+        for meta in gene.exon_metadata.values(): 
+            windows.setdefault((meta['chromosome'], strand), []).append((int(meta['start']), int(meta['end'])))
+    shared = {}
+    for (chrom, strand), intervals in windows.items(): 
+        for start, end in merge_intervals(intervals): 
+            seq = genome.fetch(chrom, start, end).upper()
+            shared[(chrom, start, end, strand)] = {'seq':seq if strand == '+' else _rev_complement(complements, seq)}
+    return shared
@@ -5,17 +5,31 @@ Date: 231204
 {Description: Annotate how often a guide appears in the genome reference file}
 """
 
+import os
+import re
+import gzip
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import pandas as pd
 import numpy as np
 
-from be_scan.sgrna._genomic_ import rev_complement, complements
-# from _genomic_ import rev_complement, complements
+from be_scan.sgrna._genomic_ import validate_dna, process_PAM, _rev_complement, complements, cas_key
+from be_scan.sgrna._sequence_ import rev_complement_seqs
+from be_scan.sgrna._faidx_ import read_fai, fai_byte_pos
+from be_scan.sgrna._kmer_index_ import KmerIndex, build_kmer_index
+from be_scan.sgrna._offtarget_ import mismatch_counts
+# from _genomic_ import validate_dna, process_PAM, _rev_complement, complements, cas_key
+# from _sequence_ import rev_complement_seqs
+# from _faidx_ import read_fai, fai_byte_pos
+# from _kmer_index_ import KmerIndex, build_kmer_index
+# from _offtarget_ import mismatch_counts
 import ahocorasick # https://github.com/WojciechMula/pyahocorasick
 
 def reference_check(guides_file, genome_file, 
 
-    output_name="filtered.csv", output_dir='', delete=False,
+    output_name="filtered.csv", output_dir='', delete=False, block_size=2**22, 
+    n_jobs=1, fai_filepath=None, shard_size=2**25, index_dir=None, mismatches=0, PAM=None, 
     return_df=True, save_df=True, 
     ): 
 
@@ -30,7 +44,7 @@ def reference_check(guides_file, genome_file,
     guides_file: str or path
         The file with the gene .fasta sequence
     genome_file: str or path
-        The file with the genome .fasta sequence
+        The file with the genome .fasta sequence, optionally .gz
 
     output_name : str or path, default 'guides.csv'
         Name of the output .csv guides file
@@ -38,6 +52,30 @@ def reference_check(guides_file, genome_file,
         Directory path of the output .cs guides file
     delete : bool, default False
         Whether or not to delete guides with multiple genomic occurrences
+    block_size : int, default 2**22
+        Number of characters of the genome file read at a time
+    n_jobs : int, default 1
+        Number of processes scanning shards of the genome at once, 
+        a .gz genome is always scanned in one process
+    fai_filepath : str or path, default None
+        The .fai index of the genome, defaults to the genome path plus .fai, 
+        with an index records are sharded by byte range, without one by record
+    shard_size : int, default 2**25
+        Number of bases of a record scanned by one shard when sharding with a .fai index
+    index_dir : str or path, default None
+        Directory of a k-mer index of the genome (see build_kmer_index) to count guides from instead of scanning, 
+        the index is built if it does not exist or the genome has changed, 
+        guides that are not the length of the k-mers or have lowercase bases are still scanned
+    mismatches : int, default 0
+        Also count occurrences with 1 up to mismatches mismatches into columns 'ref_mismatch_0' to 'ref_mismatch_{mismatches}', 
+        on both strands like the PAM counts, so 'ref_mismatch_0' also counts the reverse complement of coding_seq 
+        where 'ref_occurrences' does not, 
+        for guides of the most common length with only uppercase ACGT, other guides are left empty, 
+        genome k-mers are read from the index in index_dir if it has k-mers of that length
+    PAM : str, default None
+        A PAM sequence, or a cas_type, to also count the occurrences of each sgRNA_seq on both strands 
+        that are followed by the PAM and those that are not, in the same pass over the genome, 
+        the index in index_dir is not used for these counts, all guides are scanned
     return_df : bool, default True
         Whether or not to return the resulting dataframe
     save_df : bool, default True
@@ -47,7 +85,8 @@ def reference_check(guides_file, genome_file,
     ------------
     merged_df : pandas dataframe
         Contains fwd and rev guides in 'sgRNA_seq', 'sgRNA_strand', 'coding_seq'
-        and also contains 'ref_occurrences'
+        and also contains 'ref_occurrences', and the 'ref_mismatch_' columns if mismatches > 0, 
+        and 'ref_PAM_occurrences' and 'ref_nonPAM_occurrences' if a PAM is input
     """
     path = Path.cwd()
     
@@ -55,48 +94,92 @@ def reference_check(guides_file, genome_file,
     if isinstance(guides_file, (str, Path)):
         df = pd.read_csv(guides_file)
     else: df = guides_file.copy()
+    validate_dna(df['sgRNA_seq'], 'sgRNA_seq')
     # coding_seq IS THE INPUT INTO ALGORITHM SINCE REFERENCE IS CODING #
     if 'coding_seq' not in df.columns: 
         df['coding_seq'] = np.where(df['sgRNA_strand'] == 'sense', df['sgRNA_seq'], 
-                                    df['sgRNA_seq'].apply(lambda x: rev_complement(complements, x)))
+                                    rev_complement_seqs(df['sgRNA_seq']))
     guides_list = list(df.coding_seq)
     # DICT OF {GUIDE:GUIDE COUNT} #
     guides_dict = dict(zip(guides_list, [0]*len(guides_list)))
     
-    # CREATE AUTOMATA, LOAD IN GUIDES #
-    automaton = ahocorasick.Automaton()
-    for idx, key in enumerate(guides_list):
-       automaton.add_word(key, (idx, key))
-    automaton.make_automaton()
-    # START AUTOMATON ITERATION #
-    it = automaton.iter("")
-
-    # READ IN REFERENCE FILE LINE BY LINE #
-    genome_filepath = Path(genome_file)
-    genome = open(genome_filepath, 'r')
-    # read genome file in line by line
-    count = 0
-    while True: 
-        # GET NEXT LINE #
-        line = genome.readline().rstrip()
-        count += 1
-        if line == 'N'*80: 
-            continue
-
-        # END OF FILE #
-        if len(line) == 0 or not line:
-            print(count, 'lines processed from', genome_file)
-            break
-        
-        # UPDATE DF WITH EACH LOOP #
-        it.set(line, False)
-        for _, (_, guide) in it: 
-            guides_dict[guide] += 1
+    # LOOK UP GUIDES IN A PERSISTENT K-MER INDEX, BUILT ONCE FOR THE GENOME #
+    scan_list = list(guides_dict)
+    if index_dir is not None and PAM is None: 
+        index = KmerIndex(index_dir) if (Path(index_dir) / 'index.json').exists() else None
+        if index is None or not index.matches(genome_file): 
+            k = pd.Series([len(guide) for guide in scan_list], dtype=int).mode()
+            start_time = time.perf_counter()
+            build_kmer_index(genome_file, index_dir, k=int(k.iloc[0]) if len(k) else 20)
+            index = KmerIndex(index_dir)
+            print(index.meta['kmers']['fwd'], f'{index.k}-mers of', index.meta['records'], 'records indexed on each strand from', 
+                  genome_file, f'in {time.perf_counter()-start_time:.1f}s')
+        indexed = index.indexable(scan_list)
+        looked_up = [guide for guide, i in zip(scan_list, indexed) if i]
+        for guide, count in zip(looked_up, index.count(looked_up).tolist()): 
+            guides_dict[guide] = count
+        scan_list = [guide for guide, i in zip(scan_list, indexed) if not i]
+        print(len(looked_up), 'guides counted from the index in', index_dir, f'({len(scan_list)} guides left to scan)')
+
+    # SCAN THE GENOME IN SHARDS FOR THE REMAINING GUIDES, ADD UP THE COUNTS OF EACH GUIDE #
+    # WITH A PAM EACH sgRNA_seq AND ITS REVERSE COMPLEMENT ARE ALSO KEYS OF THE AUTOMATON, EACH DISTINCT SEQUENCE ONCE #
+    PAM = None if PAM is None else cas_key.get(PAM, PAM)
+    PAM_guides = [] if PAM is None else list(dict.fromkeys(df['sgRNA_seq']))
+    PAM_rcs = list(rev_complement_seqs(PAM_guides))
+    keys_list = list(dict.fromkeys(scan_list + PAM_guides + PAM_rcs))
+    if keys_list: 
+        lengths = [len(key) for key in keys_list]
+        min_len, max_len = min(lengths, default=1), max(lengths, default=1)
+        PAM_len = 0 if PAM is None else len(PAM)
+        start_time = time.perf_counter()
+        if n_jobs == 1 or str(genome_file).endswith('.gz'): 
+            shards, records = [(0, None, None, 0)], None
+            _init_worker(keys_list, PAM)
+            results = [_scan_shard(genome_file, shards[0], min_len, max_len, block_size)]
+        else: 
+            shards, records = genome_shards(genome_file, fai_filepath, max_len, shard_size, block_size, PAM_len)
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, 
+                                     initargs=(keys_list, PAM)) as executor: 
+                results = list(executor.map(_scan_shard, [genome_file]*len(shards), shards, 
+                                            [min_len]*len(shards), [max_len]*len(shards), [block_size]*len(shards)))
+        counts = np.sum([r[0] for r in results], axis=0)
+        key_idx = {key:idx for idx, key in enumerate(keys_list)}
+        if PAM is not None: 
+            # FWD HITS OF AN sgRNA_seq FOLLOWED BY THE PAM, AND FWD HITS OF ITS REVERSE COMPLEMENT PRECEDED BY THE PAM'S #
+            counts, fwd_PAM, rev_PAM = counts
+            fwd_idx = [key_idx[key] for key in PAM_guides]
+            rev_idx = [key_idx[key] for key in PAM_rcs]
+            PAM_counts = fwd_PAM[fwd_idx] + rev_PAM[rev_idx]
+            nonPAM_counts = counts[fwd_idx] + counts[rev_idx] - PAM_counts
+            PAM_dict = dict(zip(PAM_guides, PAM_counts.tolist()))
+            nonPAM_dict = dict(zip(PAM_guides, nonPAM_counts.tolist()))
+        counts = counts[[key_idx[key] for key in scan_list]]
+        for idx in np.flatnonzero(counts): 
+            guides_dict[scan_list[idx]] += int(counts[idx])
+        stats = {key:sum([r[1][key] for r in results]) for key in ['bytes', 'bases', 'records']}
+        stats['records'] = stats['records'] if records is None else records
+        stats['seconds'] = time.perf_counter() - start_time
+        print(stats['bases'], 'bases in', stats['records'], 'records processed from', genome_file, 
+              f"in {len(shards)} shards in {stats['seconds']:.1f}s ({stats['bytes']/max(stats['seconds'], 1e-9)/1e6:.1f} MB/s)")
 
     # CONVERT DICT TO DF #
     counts_df = pd.DataFrame(list(guides_dict.items()), columns=['coding_seq', 'ref_occurrences'])
+
+    # COUNT OCCURRENCES ON BOTH STRANDS WITH UP TO mismatches MISMATCHES BY SEED PARTITIONING #
+    if mismatches > 0: 
+        k = counts_df['coding_seq'].str.len().mode()
+        k = int(k.iloc[0]) if len(k) else 0
+        counted = (counts_df['coding_seq'].str.len() == k) & ~counts_df['coding_seq'].str.contains('[^ACGT]')
+        mm_counts = mismatch_counts(list(counts_df.loc[counted, 'coding_seq']), mismatches, genome_file, index_dir, 
+                                    n_jobs=n_jobs) if counted.any() else np.zeros((0, mismatches+1), dtype=int)
+        for d in range(mismatches+1): 
+            counts_df[f'ref_mismatch_{d}'] = pd.Series(pd.NA, index=counts_df.index, dtype='Int64')
+            counts_df.loc[counted, f'ref_mismatch_{d}'] = mm_counts[:, d]
     # MERGE WITH PREVIOUS DF #
     merged_df = pd.merge(df, counts_df, on='coding_seq', how='inner')
+    if PAM is not None: 
+        merged_df['ref_PAM_occurrences'] = merged_df['sgRNA_seq'].map(PAM_dict)
+        merged_df['ref_nonPAM_occurrences'] = merged_df['sgRNA_seq'].map(nonPAM_dict)
     # OPTIONAL TO DELETE GUIDES WITH MULTIPLE OCCURRENCES #
     if delete: 
         merged_df = merged_df.drop(merged_df[merged_df.ref_occurrences > 1].index)
@@ -110,3 +193,164 @@ def reference_check(guides_file, genome_file,
         merged_df.to_csv(path / output_dir / output_name, index=False)
     if return_df: 
         return merged_df
+
+# RUNS OF BASES THAT ARE NOT N #
+non_N_pattern = re.compile(r'[^Nn]+')
+
+def build_automaton(guides_list): 
+    """
+    Builds an Aho-Corasick automaton of a list of guides, the value of each guide is (idx, guide)
+    """
+    automaton = ahocorasick.Automaton()
+    for idx, key in enumerate(guides_list):
+       automaton.add_word(key, (idx, key))
+    automaton.make_automaton()
+    return automaton
+
+def scan_genome(genome_file, automaton, min_len, max_len, block_size=2**22, stats=None, 
+                start=0, end=None, max_start=None, min_start=0, PAM=None): 
+    """
+    Scans a genome .fasta (optionally .gz) file with an Aho-Corasick automaton, block_size characters at a time, 
+    newlines are removed and the last max_len-1 bases of a record are carried into the next block, 
+    so words across line and block breaks are found, runs of N are skipped, 
+    yields the value of each match and fills stats with the bytes, bases, records and seconds
+
+    Only the bytes from start to end are read, a range starting inside a record is scanned as part of that record, 
+    and matches starting at or after the max_start base of the range (or of each of its records) 
+    or before its min_start base are skipped
+
+    With a PAM, (value, fwd, rev) is yielded for each match, fwd is whether the PAM follows the match 
+    and rev is whether the reverse complement of the PAM precedes it, 
+    2*len(PAM) more bases are carried and a match is yielded once the bases after it are read, 
+    a PAM cut off by a run of N or the end of a record does not match
+    """
+    genome_file = str(genome_file)
+    handle = gzip.open(genome_file, 'rb') if genome_file.endswith('.gz') else open(genome_file, 'rb')
+    stats = {} if stats is None else stats
+    stats.update({'bytes':0, 'bases':0, 'records':0})
+    start_time = time.perf_counter()
+    PAM_regex, PAM_len = (None, 0) if PAM is None else (process_PAM(PAM), len(PAM))
+    max_start = float('inf') if max_start is None else max_start
+
+    carry, leftover = '', ''
+    record_bases = 0 # BASES OF THE CURRENT RECORD BEFORE THIS BLOCK #
+    with handle: 
+        handle.seek(start)
+        remaining = float('inf') if end is None else end-start
+        while True: 
+            block = handle.read(int(min(block_size, remaining))).decode('latin-1')
+            remaining -= len(block)
+            stats['bytes'] += len(block)
+            text, leftover = leftover + block, ''
+            # A HEADER LINE CUT OFF BY THE END OF THE BLOCK IS FINISHED IN THE NEXT BLOCK #
+            cut = text.rfind('\n') + 1
+            if block and text.startswith('>', cut): 
+                text, leftover = text[:cut], text[cut:]
+
+            pos = 0
+            while pos < len(text) or not block: 
+                header = text.find('>', pos)
+                seq = text[pos:len(text) if header == -1 else header].replace('\n', '').replace('\r', '')
+                # THE RECORD ENDS IN THIS TEXT, MATCHES WAITING FOR THEIR PAM IN THE CARRY ARE YIELDED WITHOUT IT #
+                closed = header != -1 or not block
+                if seq or (closed and PAM_len and carry): 
+                    stats['bases'] += max(0, min(record_bases+len(seq), max_start) - max(record_bases, min_start))
+                    scanned = carry + seq
+                    offset = record_bases - len(carry) # RECORD POSITION OF THE FIRST BASE OF scanned #
+                    for piece in non_N_pattern.finditer(scanned): 
+                        # PIECES TOO SHORT FOR A GUIDE, OR ALREADY SCANNED WITH THE PREVIOUS BLOCK #
+                        if piece.end()-piece.start() < min_len or piece.end() < len(carry) or (piece.end() == len(carry) and not PAM_len): 
+                            continue
+                        piece_closed = closed or piece.end() < len(scanned)
+                        bases = piece.group()
+                        for end_i, value in automaton.iter(bases): 
+                            match_end = piece.start()+end_i+1
+                            match_start = match_end-len(value[1])
+                            # EACH MATCH IS YIELDED WITH THE FIRST BLOCK THAT HAS ITS PAM_len BASES AFTER IT OR ENDS ITS PIECE #
+                            if match_end+PAM_len <= len(carry) or (match_end+PAM_len > len(scanned) and not piece_closed): 
+                                continue
+                            # MATCHES STARTING OUTSIDE [min_start, max_start) BELONG TO ANOTHER SHARD #
+                            if not min_start <= offset+match_start < max_start: 
+                                continue
+                            if PAM_regex is None: 
+                                yield value
+                                continue
+                            s, e = match_start-piece.start(), match_end-piece.start()
+                            fwd = PAM_regex.fullmatch(bases[e:e+PAM_len]) is not None
+                            rev = s >= PAM_len and PAM_regex.fullmatch(_rev_complement(complements, bases[s-PAM_len:s])) is not None
+                            yield value, fwd, rev
+                    carry = scanned[max(0, len(scanned)-(max_len-1+2*PAM_len)):]
+                    record_bases += len(seq)
+                if header == -1: 
+                    break
+                # NEW RECORD, NOTHING IS CARRIED ACROSS RECORDS #
+                line_end = text.find('\n', header)
+                pos = len(text) if line_end == -1 else line_end+1
+                carry, record_bases = '', 0
+                stats['records'] += 1
+            if not block: 
+                break
+    stats['seconds'] = time.perf_counter() - start_time
+
+def genome_shards(genome_file, fai_filepath=None, max_len=1, shard_size=2**25, block_size=2**22, PAM_len=0): 
+    """
+    Splits a genome .fasta file into shards of (start byte, end byte, max_start, min_start) for scan_genome, 
+    with a .fai index each record is split into byte ranges of shard_size bases, 
+    overlapping the next range by max_len-1+PAM_len bases so no match or the PAM after it is split, 
+    and starting PAM_len bases early for the PAM before a match, 
+    without an index each record is a shard, 
+    returns the shards and the number of records
+    """
+    fai_filepath = str(genome_file)+'.fai' if fai_filepath is None else fai_filepath
+    if os.path.exists(fai_filepath): 
+        index = read_fai(fai_filepath)
+        shards = []
+        for record in index.values(): 
+            length = record[0]
+            for b0 in range(0, length, shard_size): 
+                a0 = max(b0-PAM_len, 0)
+                b1 = min(b0+shard_size+max_len-1+PAM_len, length)
+                shards.append((fai_byte_pos(record, a0), fai_byte_pos(record, b1-1)+1, b0-a0+shard_size, b0-a0))
+        return shards, len(index)
+
+    # BYTE POSITIONS OF EACH HEADER, A '>' AT THE START OF A LINE #
+    headers, pos, last = [], 0, b'\n'
+    with open(genome_file, 'rb') as f: 
+        while True: 
+            block = f.read(block_size)
+            if not block: 
+                break
+            text = last + block
+            i = text.find(b'\n>')
+            while i != -1: 
+                headers.append(pos+i)
+                i = text.find(b'\n>', i+1)
+            pos += len(block)
+            last = block[-1:]
+    # SEQUENCE BEFORE THE FIRST HEADER IS SCANNED AS ITS OWN RECORD #
+    if not headers or headers[0] != 0: 
+        headers.insert(0, 0)
+    shards = [(headers[i], headers[i+1], None, 0) for i in range(len(headers)-1)] + [(headers[-1], pos, None, 0)]
+    return shards, len(shards)
+
+# automaton OF EACH WORKER PROCESS, SET ONCE BY _init_worker #
+_worker_data = {}
+
+def _init_worker(guides_list, PAM=None): 
+    _worker_data['guides_list'] = guides_list
+    _worker_data['automaton'] = build_automaton(guides_list)
+    _worker_data['PAM'] = PAM
+
+def _scan_shard(genome_file, shard, min_len, max_len, block_size): 
+    """
+    Scans one shard of the genome, returns the count of each guide by index and the stats of the shard, 
+    with a PAM the counts are rows of all matches, matches followed by the PAM and matches preceded by its reverse complement
+    """
+    stats, n, PAM = {}, len(_worker_data['guides_list']), _worker_data['PAM']
+    matches = scan_genome(genome_file, _worker_data['automaton'], min_len, max_len, block_size, stats, *shard, PAM=PAM)
+    if PAM is None: 
+        idxs = [idx for idx, _ in matches]
+        return np.bincount(np.array(idxs, dtype=np.int64), minlength=n), stats
+    hits = np.array([(idx, fwd, rev) for (idx, _), fwd, rev in matches], dtype=np.int64).reshape(-1, 3)
+    return np.stack([np.bincount(hits[mask, 0], minlength=n) for mask in 
+                     [np.ones(len(hits), dtype=bool), hits[:, 1] == 1, hits[:, 2] == 1]]), stats
@@ -0,0 +1,240 @@
+"""
+Author: Calvin XiaoYang Hu
+Date: 240610
+
+{Description: Generates a library chunk by chunk and appends each chunk to a .csv or .parquet file, 
+so memory is bounded by the chunk size instead of the library size}
+"""
+
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+from pathlib import Path
+
+from be_scan.sgrna._guideRNA_ import filter_guide, filter_sequence
+from be_scan.sgrna._gene_ import GeneForCRISPR
+from be_scan.sgrna._guide_table_ import GuideTable
+from be_scan.sgrna.generate_library import preprocess_inputs
+# from _guideRNA_ import filter_guide, filter_sequence
+# from _gene_ import GeneForCRISPR
+# from _guide_table_ import GuideTable
+# from generate_library import preprocess_inputs
+
+def stream_library(
+    gene_filepath, 
+    cas_type, edit_from, edit_to, 
+
+    gene_name='', PAM=None, window=[4,8], chunk_size=100000, 
+    output_name='guides.csv', output_dir='', output_format='csv', 
+    exclude_introns=False, exclude_nonediting=False, exclude_duplicates=True, exclude_sequences=['TTTT'], 
+    ): 
+
+    """[Summary]
+    Generates the same guides as generate_library, 
+    but writes them to a .csv or .parquet file one chunk at a time.
+
+    Parameters
+    ------------
+    gene_filepath: str or path
+        The file with the gene .fasta sequence
+    cas_type: str
+        A type of predetermined Cas (ie Sp, SpG, SpRY, etc)
+        This variable is superceded by PAM
+    edit_from: char
+        The base (ACTG) to be replaced
+    edit_to: char
+        The base (ACTG) to replace with
+
+    gene_name: str, default ''
+        The name of the gene, can be any string
+    PAM: str, default None
+        Optional field to input a custom PAM or a known PAM
+        This field supercedes cas_type
+    window: tuple or list, default = [4,8]
+        Editing window, 4th to 8th bases inclusive by default
+    chunk_size: int, default 100000
+        Number of guides enumerated and written at a time
+
+    output_name : str or path, default 'guides.csv'
+        Name of the output guides file
+    output_dir : str or path, default ''
+        Directory path of the output guides file
+    output_format : str, default 'csv'
+        Format of the output guides file (csv, parquet), parquet requires pyarrow
+    exclude_introns : bool, default True
+        Whether or not the editible base needs to be in an intron
+    exclude_nonediting : bool, default True
+        Whether or not the editible base needs to be in the window
+    exclude_duplicates : bool, default True
+        Whether or not duplicate guides should be removed from the pool
+    exclude_sequences : list of strings, defailt ['TTTT']
+        Exclude guides with sequences in this list
+
+    Returns
+    ------------
+    count : int
+        The number of guides written
+    """
+    path = Path.cwd()
+    Path.mkdir(path / output_dir, exist_ok=True)
+    filepath = path / output_dir / output_name
+    if output_format == 'csv': writer = CSVChunkWriter(filepath)
+    elif output_format == 'parquet': writer = ParquetChunkWriter(filepath)
+    else: raise Exception('Improper output_format input, the options are csv, parquet')
+
+    iter_library_params = {
+        'gene_filepath':gene_filepath, 'cas_type':cas_type, 'edit_from':edit_from, 'edit_to':edit_to, 
+        'gene_name':gene_name, 'PAM':PAM, 'window':window, 'chunk_size':chunk_size, 
+        'exclude_introns':exclude_introns, 'exclude_nonediting':exclude_nonediting, 
+        'exclude_duplicates':exclude_duplicates, 'exclude_sequences':exclude_sequences, }
+    count = 0
+    for chunk in iter_library(**iter_library_params): 
+        writer.write(chunk)
+        count += chunk.shape[0]
+    writer.close()
+
+    print(count, 'guides were written to', str(filepath))
+    return count
+
+def iter_library(
+    gene_filepath, 
+    cas_type, edit_from, edit_to, 
+
+    gene_name='', PAM=None, window=[4,8], chunk_size=100000, 
+    exclude_introns=False, exclude_nonediting=False, exclude_duplicates=True, exclude_sequences=['TTTT'], 
+    ): 
+
+    """[Summary]
+    Yields the guides of generate_library as dataframes of at most chunk_size guides, 
+    in the same order and with the same columns.
+    If exclude_duplicates, the gene is enumerated twice, 
+    first to count each sequence in an on-disk table and then to yield the unique guides.
+
+    Parameters
+    ------------
+    See stream_library
+
+    Yields
+    ------------
+    df : pandas dataframe
+        A chunk of guides with the generate_library columns
+    """
+    edit, PAM, PAM_regex = preprocess_inputs(cas_type, edit_from, edit_to, PAM, window)
+
+    # CREATE GENE OBJECT #
+    gene = GeneForCRISPR(filepath=gene_filepath)
+    gene.parse_exons()
+    gene.extract_metadata()
+    filter_guide_input = {'PAM_regex':PAM_regex, 'edit':edit, 'window':window, 
+                          'excl_introns':exclude_introns, 'excl_nonediting':exclude_nonediting}
+
+    def filtered_chunks(): 
+        for strand in ['sense', 'antisense']: 
+            buffer, buffer_len = [], 0
+            for guides in gene.iter_guides(window, PAM=PAM, strand=strand, chunk_size=chunk_size): 
+                guides = guides.subset(filter_guide(guides, **filter_guide_input))
+                for sequence in exclude_sequences: 
+                    guides = filter_sequence(guides, sequence)
+                buffer.append(guides)
+                buffer_len += len(guides)
+                # YIELD FULL CHUNKS ONCE ENOUGH FILTERED GUIDES HAVE BUILT UP #
+                if buffer_len >= chunk_size: 
+                    guides = GuideTable.concat(strand, buffer)
+                    full = (buffer_len // chunk_size) * chunk_size
+                    for c in range(0, full, chunk_size): 
+                        yield guides.subset(slice(c, c+chunk_size))
+                    buffer, buffer_len = [guides.subset(slice(full, None))], buffer_len-full
+            if buffer_len > 0: 
+                yield GuideTable.concat(strand, buffer)
+
+    if not exclude_duplicates: 
+        for guides in filtered_chunks(): 
+            yield guides.to_frame(gene.strand, gene_name)
+        return
+
+    # DELETE DUPLICATES BETWEEN FWD, BETWEEN REV, BETWEEN FWD AND REV #
+    counter = SequenceCounter()
+    try: 
+        for guides in filtered_chunks(): 
+            counter.add(guides['sgRNA_seq'])
+        for guides in filtered_chunks(): 
+            guides = guides.subset(~counter.duplicated(guides['sgRNA_seq']))
+            if len(guides) > 0: 
+                yield guides.to_frame(gene.strand, gene_name)
+    finally: 
+        counter.close()
+
+class SequenceCounter(): 
+    """
+    A disk-backed count of sequences, used to find duplicate guides
+    without holding every sequence of a library in memory
+    """
+    def __init__(self, directory=None): 
+        self.directory = tempfile.mkdtemp(dir=directory)
+        self.connection = sqlite3.connect(str(Path(self.directory) / 'sequences.db'))
+        self.connection.execute('CREATE TABLE seqs (seq BLOB PRIMARY KEY, count INTEGER)')
+        self.connection.execute('CREATE TEMP TABLE query (i INTEGER, seq BLOB)')
+
+    # ADD ONE TO THE COUNT OF EACH SEQUENCE #
+    def add(self, seqs): 
+        self.connection.executemany(
+            'INSERT INTO seqs VALUES (?, 1) ON CONFLICT(seq) DO UPDATE SET count = count + 1', 
+            ((bytes(s),) for s in seqs))
+        self.connection.commit()
+
+    # BOOLEAN MASK OF SEQUENCES COUNTED MORE THAN ONCE #
+    def duplicated(self, seqs): 
+        self.connection.execute('DELETE FROM query')
+        self.connection.executemany('INSERT INTO query VALUES (?, ?)', enumerate(bytes(s) for s in seqs))
+        rows = self.connection.execute(
+            'SELECT query.i FROM query JOIN seqs ON query.seq = seqs.seq WHERE seqs.count > 1')
+        mask = np.zeros(len(seqs), dtype=bool)
+        mask[[i for (i,) in rows]] = True
+        return mask
+
+    def close(self): 
+        self.connection.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class CSVChunkWriter(): 
+    """
+    Appends dataframes to one .csv file, the header is only written with the first chunk
+    """
+    def __init__(self, filepath): 
+        self.filepath = Path(filepath)
+        self.started = False
+
+    def write(self, df): 
+        df.to_csv(self.filepath, mode='a' if self.started else 'w', header=not self.started, index=False)
+        self.started = True
+
+    def close(self): 
+        # AN EMPTY LIBRARY STILL GETS A HEADER #
+        if not self.started: 
+            self.write(GuideTable.from_rows('sense', []).to_frame('', ''))
+
+class ParquetChunkWriter(): 
+    """
+    Appends dataframes to one .parquet file as row groups, requires pyarrow
+    """
+    def __init__(self, filepath): 
+        try: 
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError: 
+            raise ImportError('pyarrow is required to write .parquet files, install it with pip install pyarrow')
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.filepath = Path(filepath)
+        self.writer = None
+
+    def write(self, df): 
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None: 
+            self.writer = self.pq.ParquetWriter(str(self.filepath), table.schema)
+        self.writer.write_table(table)
+
+    def close(self): 
+        if self.writer is None: 
+            self.write(GuideTable.from_rows('sense', []).to_frame('', ''))
+        self.writer.close()
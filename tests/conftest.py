@@ -0,0 +1,25 @@
+import random
+
+import pytest
+
+def write_gene(path, strand='+', n_exons=4, pad=20, seed=0):
+    """
+    Writes a UCSC style .fasta file of n_exons random exons with pad lowercase intronic bases on each side, 
+    the coding sequence is a whole number of codons
+    """
+    rng = random.Random(seed)
+    lengths = [rng.randint(60, 200) for _ in range(n_exons)]
+    lengths[-1] -= sum(lengths) % 3
+    records, start = [], 1000
+    for k, length in enumerate(lengths):
+        seq = ''.join(rng.choice('acgt') for _ in range(pad)) + ''.join(rng.choice('ACGT') for _ in range(length)) + \
+              ''.join(rng.choice('acgt') for _ in range(pad))
+        records.append(f">hg38_knownGene_test_{k} range=chr7:{start}-{start+len(seq)-1} " + 
+                       f"5'pad={pad} 3'pad={pad} strand={strand} repeatMasking=none\n{seq}")
+        start += len(seq) + 500
+    path.write_text('\n'.join(records) + '\n')
+    return path
+
+@pytest.fixture
+def gene_fasta(tmp_path):
+    return lambda name='gene.fasta', **kwargs: write_gene(tmp_path / name, **kwargs)
@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from be_scan.sgrna._gene_ import GeneForCRISPR
+from be_scan.sgrna._guide_table_ import GuideTable
+
+AR_fasta = Path(__file__).parent / 'test_data' / 'sgrna' / '230408_AR_Input.fasta'
+
+def guides(filepath, window, vectorize):
+    gene = GeneForCRISPR(filepath)
+    gene.parse_exons()
+    gene.extract_metadata()
+    gene.find_all_guides(window, vectorize=vectorize)
+    return gene.fwd_guides, gene.rev_guides
+
+@pytest.mark.parametrize('window', [[4, 8], [3, 9], [1, 19]])
+def test_vectorize_matches_loop(gene_fasta, window):
+    for filepath in [gene_fasta('plus.fasta', strand='+', seed=1), gene_fasta('minus.fasta', strand='-', seed=2)]:
+        for array, loop in zip(guides(filepath, window, True), guides(filepath, window, False)):
+            assert len(array) == len(loop) > 0
+            for field in GuideTable.fields:
+                assert np.array_equal(array[field], loop[field]), (filepath.name, array.strand, field)
+
+@pytest.mark.skipif(not AR_fasta.exists(), reason='AR test gene not found')
+def test_vectorize_matches_loop_AR():
+    for array, loop in zip(guides(AR_fasta, [4, 8], True), guides(AR_fasta, [4, 8], False)):
+        assert len(array) == len(loop) > 0
+        for field in GuideTable.fields:
+            assert np.array_equal(array[field], loop[field]), (array.strand, field)
+
+@pytest.mark.parametrize('PAM', [None, 'NGG'])
+def test_iter_guides_chunks(gene_fasta, monkeypatch, PAM):
+    gene = GeneForCRISPR(gene_fasta(n_exons=2, seed=3))
+    gene.parse_exons()
+    gene.extract_metadata()
+    whole = {strand:GuideTable.concat(strand, list(gene.iter_guides([4, 8], PAM=PAM, strand=strand))) 
+             for strand in ['sense', 'antisense']}
+    # SEQUENCES ARE ONLY BUILT FOR ONE CHUNK OF OFFSETS AT A TIME #
+    built, exon_seqs = [], GeneForCRISPR._exon_seqs
+    def record(self, *args):
+        seqs = exon_seqs(self, *args)
+        built.append(len(seqs['sgRNA_seq']))
+        return seqs
+    monkeypatch.setattr(GeneForCRISPR, '_exon_seqs', record)
+    for strand in ['sense', 'antisense']:
+        chunks = list(gene.iter_guides([4, 8], PAM=PAM, strand=strand, chunk_size=7))
+        assert all(len(chunk) <= 7 for chunk in chunks)
+        for field in GuideTable.fields:
+            assert np.array_equal(GuideTable.concat(strand, chunks)[field], whole[strand][field])
+    assert 0 < max(built) <= 7
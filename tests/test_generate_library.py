@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from be_scan.sgrna.generate_library import generate_library
+from be_scan.sgrna.annotate import annotate
+
+def library(filepath, cas_type, PAM=None):
+    df, gene = generate_library(filepath, cas_type, 'A', 'G', PAM=PAM, save_df=False)
+    return df
+
+def test_cas_list_matches_single_runs(gene_fasta):
+    filepath = gene_fasta(seed=4)
+    df = library(filepath, ['Sp', 'SpG'])
+    assert list(df['cas_type'].unique()) == ['Sp', 'SpG']
+    for cas in ['Sp', 'SpG']:
+        single = library(filepath, cas)
+        pd.testing.assert_frame_equal(df[df['cas_type'] == cas].drop(columns='cas_type').reset_index(drop=True), single)
+
+def test_PAM_list_matches_single_runs(gene_fasta):
+    filepath = gene_fasta(seed=5)
+    df = library(filepath, 'Sp', PAM=['NGG', 'NGA'])
+    assert list(df['cas_type'].unique()) == ['NGG', 'NGA']
+    for PAM in ['NGG', 'NGA']:
+        single = library(filepath, 'Sp', PAM=PAM)
+        pd.testing.assert_frame_equal(df[df['cas_type'] == PAM].drop(columns='cas_type').reset_index(drop=True), single)
+
+def test_cas_list_paired_with_PAM_list(gene_fasta):
+    filepath = gene_fasta(seed=6)
+    df, gene = generate_library(filepath, ['Sp', 'SpG'], 'A', 'G', PAM=[None, 'NGN'], save_df=False)
+    assert list(df['cas_type'].unique()) == ['Sp', 'NGN']
+    # GUIDES IN BOTH LIBRARIES ARE KEPT IN BOTH BY annotate, DUPLICATES ARE ONLY REMOVED WITHIN EACH cas_type #
+    annotated = annotate(df, 'A', 'G', gene.exons, save_df=False)
+    assert annotated['cas_type'].value_counts().to_dict() == df['cas_type'].value_counts().to_dict()
+
+@pytest.mark.parametrize('cas_type, PAM', [(['Sp', 'SpG'], 'NGG'), (['Sp', 'Sp'], None), ('Sp', ['NGG', 'NGG'])])
+def test_libraries_must_differ(gene_fasta, cas_type, PAM):
+    with pytest.raises(Exception):
+        library(gene_fasta(seed=7), cas_type, PAM=PAM)
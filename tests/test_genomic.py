@@ -0,0 +1,23 @@
+import pytest
+
+from be_scan.sgrna._genomic_ import DNA_to_AA, rev_complement, complement, complements
+from be_scan.sgrna._genomic_ import _DNA_to_AA, _rev_complement
+
+def test_sequence_functions():
+    assert DNA_to_AA('ATGtaa') == 'M.'
+    assert DNA_to_AA('ATGtaa', upper=False) == 'M_'
+    assert rev_complement(complements, 'AACgt') == 'acGTT'
+    assert complement(complements, 'AACgt') == 'TTGca'
+
+@pytest.mark.parametrize('seq', ['ATGNNN', 'ATG-TA', 'ATGRYA'])
+def test_sequence_functions_reject_non_ACGT(seq):
+    with pytest.raises(AssertionError):
+        DNA_to_AA(seq)
+    with pytest.raises(AssertionError):
+        rev_complement(complements, seq)
+    with pytest.raises(AssertionError):
+        complement(complements, seq)
+
+def test_unchecked_kernels_keep_other_bases():
+    assert _rev_complement(complements, 'ACNnt') == 'anNGT'
+    assert _DNA_to_AA('ATGNNN') == 'M_'
@@ -0,0 +1,132 @@
+import random
+
+import pandas as pd
+import pytest
+
+from be_scan.sgrna.reference_check import reference_check
+from be_scan.sgrna._genomic_ import _rev_complement, complements, process_PAM
+from be_scan.sgrna._faidx_ import build_fai
+
+def random_records(seed=0):
+    """
+    A few random records as lists of bases, with runs of N and soft masked bases
+    """
+    rng = random.Random(seed)
+    records = []
+    for r in range(3):
+        seq = [rng.choice('ACGT') for _ in range(rng.randint(800, 1500))]
+        for _ in range(3):
+            s, n = rng.randrange(len(seq) - 40), rng.randint(1, 30)
+            seq[s:s+n] = 'N' * n
+            s = rng.randrange(len(seq) - 40)
+            seq[s:s+30] = [b.lower() for b in seq[s:s+30]]
+        records.append(seq)
+    return rng, records
+
+def mutate(rng, seq, n):
+    seq = list(seq)
+    for i in rng.sample(range(len(seq)), n):
+        seq[i] = rng.choice([b for b in 'ACGT' if b != seq[i]])
+    return ''.join(seq)
+
+def hamming_counts(records, guide, mismatches):
+    """
+    Counts of a guide by number of mismatches over every window of uppercase ACGT of both strands
+    """
+    k = len(guide)
+    targets = [guide, _rev_complement(complements, guide)]
+    counts = [0] * (mismatches+1)
+    for seq in records:
+        for i in range(len(seq)-k+1):
+            window = seq[i:i+k]
+            if window.strip('ACGT'):
+                continue
+            for target in targets:
+                d = sum(a != b for a, b in zip(window, target))
+                if d <= mismatches:
+                    counts[d] += 1
+    return counts
+
+@pytest.fixture
+def genome(tmp_path):
+    rng, records = random_records()
+    k, guides = 12, []
+    for _ in range(12):
+        seq = records[rng.randrange(3)]
+        s = rng.randrange(len(seq) - k)
+        guides.append(''.join(seq[s:s+k]).upper().replace('N', 'A'))
+    # PLANT COPIES WITH 0 TO 2 MISMATCHES ON BOTH STRANDS, INCLUDING AT THE ENDS OF RECORDS #
+    for guide in guides[:8]:
+        for _ in range(3):
+            copy = mutate(rng, guide, rng.randint(0, 2))
+            copy = copy if rng.random() < 0.5 else _rev_complement(complements, copy)
+            seq = records[rng.randrange(3)]
+            s = rng.choice([0, len(seq)-k, rng.randrange(len(seq)-k)])
+            seq[s:s+k] = copy
+    records = [''.join(seq) for seq in records]
+    genome_file = tmp_path / 'genome.fasta'
+    genome_file.write_text(''.join(f'>chr{r} test\n' + '\n'.join(seq[i:i+60] for i in range(0, len(seq), 60)) + '\n'
+                                   for r, seq in enumerate(records)))
+    guides += [''.join(rng.choice('ACGT') for _ in range(k)) for _ in range(4)]
+    # ONE GUIDE ON THE ANTISENSE STRAND, COUNTED BY ITS coding_seq #
+    df = pd.DataFrame({'sgRNA_seq':guides[:-1] + [_rev_complement(complements, guides[-1])],
+                       'sgRNA_strand':['sense']*(len(guides)-1) + ['antisense']})
+    return genome_file, records, guides, df
+
+@pytest.mark.parametrize('use_index', [False, True])
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_mismatch_counts_match_hamming_scan(genome, tmp_path, use_index, n_jobs):
+    genome_file, records, guides, df = genome
+    mismatches = 2
+    out = reference_check(df, genome_file, mismatches=mismatches, n_jobs=n_jobs,
+                          index_dir=tmp_path / 'index' if use_index else None, save_df=False)
+    assert list(out['coding_seq']) == guides
+    for guide, (_, row) in zip(guides, out.iterrows()):
+        expected = hamming_counts(records, guide, mismatches)
+        assert [row[f'ref_mismatch_{d}'] for d in range(mismatches+1)] == expected, guide
+        # ref_occurrences COUNTS THE FORWARD STRAND ONLY #
+        assert row['ref_occurrences'] == sum(seq[i:i+len(guide)] == guide for seq in records for i in range(len(seq)))
+    assert out[[f'ref_mismatch_{d}' for d in range(mismatches+1)]].to_numpy().sum() > len(guides)
+
+def PAM_hamming_counts(records, guide, PAM):
+    """
+    Occurrences of a guide on both strands with and without the PAM after it, by a scan of every window
+    """
+    PAM_regex, k, P = process_PAM(PAM), len(guide), len(PAM)
+    rc = _rev_complement(complements, guide)
+    counts = [0, 0]
+    for seq in records:
+        for i in range(len(seq)-k+1):
+            if seq[i:i+k] == guide:
+                counts[PAM_regex.fullmatch(seq[i+k:i+k+P]) is None] += 1
+            if seq[i:i+k] == rc:
+                counts[i < P or PAM_regex.fullmatch(_rev_complement(complements, seq[i-P:i])) is None] += 1
+    return counts
+
+@pytest.mark.parametrize('n_jobs, fai, shard_size', [(1, False, 2**25), (2, False, 2**25), (2, True, 1), (2, True, 8), (2, True, 37)])
+def test_PAM_counts_at_record_edges(tmp_path, n_jobs, fai, shard_size):
+    rng = random.Random(1)
+    def filler(n):
+        return ''.join(rng.choice('ACGT') for _ in range(n))
+    guide = filler(20)
+    rc = _rev_complement(complements, guide)
+    records = [
+        guide + 'AGG' + filler(30) + 'CCT' + rc, # PAM ON BOTH STRANDS AT THE ENDS OF A RECORD #
+        rc + filler(30) + guide + 'TG', # NO BASES BEFORE rc, PAM CUT OFF BY THE END OF THE RECORD #
+        'CC' + rc + filler(30) + guide, # PAM CUT OFF BY THE START OF THE RECORD, NO BASES AFTER guide #
+        filler(10) + guide + 'NGG' + filler(10) + 'CCN' + rc + filler(10), # PAM CUT OFF BY A RUN OF N #
+        filler(10) + guide + 'T', # PAM SPLIT ACROSS TWO RECORDS #
+        'GG' + filler(10),
+        guide + 'tgg' + filler(10) + 'cca' + rc, # SOFT MASKED PAM #
+    ]
+    genome_file = tmp_path / 'genome.fasta'
+    genome_file.write_text(''.join(f'>chr{r}\n' + '\n'.join(seq[i:i+7] for i in range(0, len(seq), 7)) + '\n'
+                                   for r, seq in enumerate(records)))
+    if fai:
+        build_fai(genome_file)
+    df = pd.DataFrame({'sgRNA_seq':[guide, rc], 'sgRNA_strand':['sense', 'sense']})
+    out = reference_check(df, genome_file, PAM='NGG', n_jobs=n_jobs, shard_size=shard_size, save_df=False)
+    counts = out.set_index('sgRNA_seq')[['ref_PAM_occurrences', 'ref_nonPAM_occurrences']]
+    assert counts.loc[guide].tolist() == [4, 7]
+    for seq in [guide, rc]:
+        assert counts.loc[seq].tolist() == PAM_hamming_counts(records, seq, 'NGG'), seq